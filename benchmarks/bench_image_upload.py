@@ -0,0 +1,175 @@
+"""
+上传基准测试：本地启动模拟 Telegram 和 Cloudflare KV 的 HTTP 服务，
+对比每次新建连接、共享 requests.Session 的 ImageUploader 与 AsyncImageUploader 的耗时、请求数和连接数
+
+AsyncImageUploader 通过调度器合并发送（sendMediaGroup）并按 Telegram 每分钟 20 条限速，
+同时给出默认限速和不限速（只看合并发送和 KV 批量写入的效果）两组结果；--concurrency 为逐条写 KV 的并发数
+
+每个新连接的首个请求额外延迟 --handshake 秒，用来模拟 TLS 握手开销
+
+用法: python benchmarks/bench_image_upload.py [--images 50] [--latency 0.05] [--concurrency 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import img_upload  # noqa: E402
+from img_upload import AsyncImageUploader, ImageUploader  # noqa: E402
+
+IMAGE_BYTES = b'\xff\xd8\xff' + os.urandom(200 * 1024)
+
+
+class StubServer:
+    """模拟 Telegram 和 Cloudflare KV 接口，统计请求数和连接数"""
+
+    def __init__(self, latency, handshake):
+        self.latency = latency
+        self.handshake = handshake
+        self.requests = 0
+        self.connections = set()
+        self.port = None
+        self._loop = None
+        self._runner = None
+
+    async def _delay(self, request):
+        self.requests += 1
+        transport = id(request.transport)
+        if transport not in self.connections:
+            self.connections.add(transport)
+            await asyncio.sleep(self.handshake)
+        await asyncio.sleep(self.latency)
+
+    async def send_photo(self, request):
+        await request.post()
+        await self._delay(request)
+        file_id = f'file-{self.requests}'
+        return web.json_response({'ok': True, 'result': {'photo': [
+            {'file_id': f'{file_id}-small', 'file_size': 100},
+            {'file_id': file_id, 'file_size': 1000},
+        ]}})
+
+    async def send_media_group(self, request):
+        form = await request.post()
+        await self._delay(request)
+        media = json.loads(form['media'])
+        return web.json_response({'ok': True, 'result': [
+            {'photo': [{'file_id': f'file-{self.requests}-{index}', 'file_size': 1000}]}
+            for index in range(len(media))
+        ]})
+
+    async def kv_bulk_write(self, request):
+        await request.json()
+        await self._delay(request)
+        return web.json_response({'success': True, 'errors': [], 'result': {'unsuccessful_keys': []}})
+
+    async def kv_write(self, request):
+        # 与 Cloudflare 一致，带元数据的写入只接受 multipart
+        if request.content_type != 'multipart/form-data':
+            return web.json_response({'success': False, 'errors': [{'message': f'不支持 {request.content_type}'}]},
+                                     status=400)
+        await request.read()
+        await self._delay(request)
+        return web.json_response({'success': True, 'errors': [], 'result': None})
+
+    def reset(self):
+        self.requests = 0
+        self.connections = set()
+
+    def start(self):
+        """在后台线程中运行，同步客户端也可以访问"""
+        ready = threading.Event()
+
+        async def serve():
+            app = web.Application(client_max_size=10 * 1024 * 1024)
+            app.router.add_post('/bot{token}/sendPhoto', self.send_photo)
+            app.router.add_post('/bot{token}/sendMediaGroup', self.send_media_group)
+            app.router.add_put('/accounts/{account}/storage/kv/namespaces/{namespace}/bulk', self.kv_bulk_write)
+            app.router.add_put('/accounts/{account}/storage/kv/namespaces/{namespace}/values/{key}', self.kv_write)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            ready.set()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(serve())
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+
+
+def bench_no_session(images):
+    """原实现：每次调用 requests.request，不复用连接"""
+    original = img_upload._session
+    img_upload._session = requests
+    try:
+        for index in range(images):
+            ImageUploader('.', f'site-{index}', IMAGE_BYTES, 'jpeg').upload_and_write_kv(write_kv=True)
+    finally:
+        img_upload._session = original
+
+
+def bench_shared_session(images):
+    for index in range(images):
+        ImageUploader('.', f'site-{index}', IMAGE_BYTES, 'jpeg').upload_and_write_kv(write_kv=True)
+
+
+# 不限速时的调度参数：不等待令牌、凑批和 KV 攒批只等很短时间
+UNTHROTTLED_OPTIONS = {'telegram_rate': 1000, 'telegram_batch_wait': 0.05, 'kv_flush_interval': 0.05}
+
+
+async def bench_async(images, concurrency, kv_bulk=True, **uploader_options):
+    async with AsyncImageUploader(max_concurrency=concurrency, kv_bulk=kv_bulk, **uploader_options) as uploader:
+        results = await asyncio.gather(*(
+            uploader.upload_and_write_kv(f'site-{index}', IMAGE_BYTES, image_format='jpeg', write_kv=True)
+            for index in range(images)
+        ))
+    failed = [result for result in results if 'src' not in result]
+    if failed:
+        print(f"  失败 {len(failed)} 个: {failed[0]}")
+
+
+def main(images, latency, handshake, concurrency):
+    server = StubServer(latency, handshake)
+    server.start()
+    img_upload.TG_API_BASE = f'http://127.0.0.1:{server.port}'
+    img_upload.CLOUDFLARE_API_BASE = f'http://127.0.0.1:{server.port}'
+
+    candidates = (
+        ('每次新建连接（原实现）', lambda: bench_no_session(images)),
+        ('共享 Session 的 ImageUploader', lambda: bench_shared_session(images)),
+        ('AsyncImageUploader 默认限速', lambda: asyncio.run(bench_async(images, concurrency))),
+        ('AsyncImageUploader 不限速',
+         lambda: asyncio.run(bench_async(images, concurrency, **UNTHROTTLED_OPTIONS))),
+        (f'AsyncImageUploader 不限速，逐条写 KV 并发 {concurrency}',
+         lambda: asyncio.run(bench_async(images, concurrency, kv_bulk=False, **UNTHROTTLED_OPTIONS))),
+    )
+    print(f"上传 {images} 张图片，单次延迟 {latency}s，握手延迟 {handshake}s")
+    for label, func in candidates:
+        server.reset()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<32} 耗时 {elapsed:6.2f}s, 请求 {server.requests} 次, 新建连接 {len(server.connections)} 个")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='上传基准测试')
+    parser.add_argument('--images', type=int, default=50, help='上传图片数量')
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的服务端延迟（秒）')
+    parser.add_argument('--handshake', type=float, default=0.1, help='新连接首个请求的额外延迟（秒）')
+    parser.add_argument('--concurrency', type=int, default=4, help='异步上传并发数')
+    args = parser.parse_args()
+    main(args.images, args.latency, args.handshake, args.concurrency)
@@ -0,0 +1,108 @@
+"""
+元数据解析微基准：对比原来的整页 BeautifulSoup 解析（含 get_text）、只取元数据的 BeautifulSoup 解析
+与 HeadMetadataParser 增量解析在大体积 HTML 上的耗时和内存峰值
+
+用法: python benchmarks/bench_metadata_parser.py [--sizes 1 5 20] [--repeat 3]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website_metadata import extract_metadata  # noqa: E402
+
+HEAD = '''<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>Benchmark Fixture</title>
+  <meta name="description" content="大体积页面解析测试">
+  <meta property="og:description" content="og 描述">
+  <link rel="stylesheet" href="/site.css">
+  <script>window.__STATE__ = {"items": [1, 2, 3]};</script>
+</head>
+'''
+
+BLOCK = '''<div class="card"><h2>标题 {i}</h2><p>这是一段用于撑大页面体积的正文内容，包含 <a href="/item/{i}">链接</a>
+和 <span class="tag">标签</span>。</p><ul><li>列表一</li><li>列表二</li><li>列表三</li></ul></div>
+'''
+
+
+def build_html(size_mb):
+    target = size_mb * 1024 * 1024
+    parts = [HEAD, '<body>']
+    length = len(HEAD)
+    i = 0
+    while length < target:
+        block = BLOCK.format(i=i)
+        parts.append(block)
+        length += len(block.encode('utf-8'))
+        i += 1
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def bs4_full(html):
+    """原 scrape_website 的处理方式：整页解析后提取元数据并取全文"""
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.title.string.strip() if soup.title else ''
+    meta_description = soup.find('meta', attrs={'name': 'description'})
+    description = meta_description['content'].strip() if meta_description else ''
+    soup.get_text()
+    return {'title': title, 'description': description}
+
+
+def bs4_metadata(html):
+    """整页解析但不取全文"""
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.title.string.strip() if soup.title else ''
+    meta_description = soup.find('meta', attrs={'name': 'description'})
+    description = meta_description['content'].strip() if meta_description else ''
+    return {'title': title, 'description': description}
+
+
+def measure(func, html, repeat):
+    best = None
+    # 避免上一轮大对象的回收时间计入本轮
+    gc.collect()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main(sizes, repeat):
+    candidates = (
+        ('BeautifulSoup+get_text', bs4_full),
+        ('BeautifulSoup 仅元数据', bs4_metadata),
+        ('HeadMetadataParser', extract_metadata),
+    )
+    for size_mb in sizes:
+        html = build_html(size_mb)
+        print(f"页面大小 {size_mb} MB")
+        expected = None
+        for label, func in candidates:
+            elapsed, peak, result = measure(func, html, repeat)
+            expected = expected or result
+            print(f"  {label:<24} 最快 {elapsed * 1000:10.2f} ms, 内存峰值 {peak / 1024 / 1024:8.2f} MB, "
+                  f"结果一致: {result == expected}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='元数据解析微基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 20], help='测试页面大小（MB）')
+    parser.add_argument('--repeat', type=int, default=3, help='每种方式的重复次数，取最快一次')
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
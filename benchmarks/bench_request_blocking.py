@@ -0,0 +1,123 @@
+"""
+请求拦截基准测试：在本地启动一个带慢速媒体、字体和统计脚本的夹具站点，
+对比开启/关闭 RequestBlocker 时 scrape_website 的耗时，并校验标题、描述与截图一致
+
+用法: python benchmarks/bench_request_blocking.py [--rounds 3] [--delay 2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from website_request_blocker import RequestBlocker, DEFAULT_BLOCKED_HOSTS  # noqa: E402
+from website_spider import launch_browser, scrape_website  # noqa: E402
+
+FIXTURE_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+  <title>Fixture Site</title>
+  <meta name="description" content="本地夹具站点">
+  <link rel="stylesheet" href="/static/site.css">
+  <link rel="manifest" href="/static/site.webmanifest">
+  <script async src="http://localhost:{port}/tracker/analytics.js"></script>
+  <script async src="http://localhost:{port}/tracker/pixel.js"></script>
+</head>
+<body>
+  <h1>Fixture Site</h1>
+  <img src="/static/hero.svg" width="600" height="200">
+  <video src="/media/intro.mp4" autoplay muted></video>
+  <audio src="/media/intro.mp3" autoplay></audio>
+  <img src="http://localhost:{port}/tracker/beacon.gif" width="1" height="1">
+</body>
+</html>
+'''
+
+HERO_SVG = ('<svg xmlns="http://www.w3.org/2000/svg" width="600" height="200">'
+            '<rect width="600" height="200" fill="#4a90d9"/></svg>')
+
+
+def build_app(delay):
+    async def index(request):
+        port = request.url.port
+        return web.Response(text=FIXTURE_HTML.format(port=port), content_type='text/html')
+
+    async def css(request):
+        return web.Response(text='body { font-family: sans-serif; background: #fafafa; }', content_type='text/css')
+
+    async def hero(request):
+        return web.Response(text=HERO_SVG, content_type='image/svg+xml')
+
+    async def slow(request):
+        # 模拟体积大、响应慢的媒体和第三方脚本
+        await asyncio.sleep(delay)
+        content_type = {
+            '.js': 'application/javascript',
+            '.gif': 'image/gif',
+            '.webmanifest': 'application/manifest+json',
+        }.get(Path(request.path).suffix, 'application/octet-stream')
+        return web.Response(body=b'\0' * 1024, content_type=content_type)
+
+    app = web.Application()
+    app.router.add_get('/', index)
+    app.router.add_get('/static/site.css', css)
+    app.router.add_get('/static/hero.svg', hero)
+    app.router.add_get('/static/site.webmanifest', slow)
+    app.router.add_get('/media/{name}', slow)
+    app.router.add_get('/tracker/{name}', slow)
+    return app
+
+
+async def measure(browser, url, output_dir, blocker):
+    start = time.perf_counter()
+    result = await scrape_website(url, browser, output_dir, blocker=blocker)
+    return time.perf_counter() - start, result
+
+
+async def main(rounds, delay):
+    runner = web.AppRunner(build_app(delay))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}/'
+
+    # 夹具中的第三方脚本挂在 localhost 下，额外加入拦截域名
+    blocker = RequestBlocker(host_patterns=DEFAULT_BLOCKED_HOSTS + ('localhost',))
+    browser = await launch_browser()
+    try:
+        timings = {'关闭拦截': [], '开启拦截': []}
+        results = {}
+        for _ in range(rounds):
+            for label, current_blocker in (('关闭拦截', None), ('开启拦截', blocker)):
+                output_dir = f'./bench_screenshots/{"blocked" if current_blocker else "plain"}'
+                elapsed, result = await measure(browser, url, output_dir, current_blocker)
+                timings[label].append(elapsed)
+                results[label] = (result, output_dir)
+
+        for label, values in timings.items():
+            print(f"{label}: 平均 {sum(values) / len(values):.2f}s, 最快 {min(values):.2f}s, 最慢 {max(values):.2f}s")
+
+        plain, plain_dir = results['关闭拦截']
+        blocked, blocked_dir = results['开启拦截']
+        print(f"拦截请求数: {blocked['blocked_requests']}")
+        print(f"标题/描述一致: {(plain['title'], plain['description']) == (blocked['title'], blocked['description'])}")
+        plain_shot = Path(plain_dir) / f"{plain['name']}.png"
+        blocked_shot = Path(blocked_dir) / f"{blocked['name']}.png"
+        print(f"截图大小: 关闭拦截 {plain_shot.stat().st_size} 字节, 开启拦截 {blocked_shot.stat().st_size} 字节")
+    finally:
+        await browser.close()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='请求拦截基准测试')
+    parser.add_argument('--rounds', type=int, default=3, help='每种模式的测试轮数')
+    parser.add_argument('--delay', type=float, default=2.0, help='慢速资源的响应延迟（秒）')
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds, args.delay))
@@ -0,0 +1,144 @@
+"""
+SupabaseArticlesWriter 并发基准测试：本地启动模拟 PostgREST articles 接口的 HTTP 服务，
+对比在事件循环中直接调用阻塞的 execute()（原实现）与交给线程池执行时，
+并发查询和更新的总耗时，以及事件循环被阻塞的最长时间
+
+用法: python benchmarks/bench_supabase_writer.py [--calls 40] [--latency 0.05] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 任意格式正确的 JWT 即可通过客户端校验，模拟服务不做鉴权
+STUB_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.c2ln'
+
+
+class StubPostgrest:
+    """模拟 PostgREST 的 articles 表查询和更新，统计同时处理中的请求数"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.port = None
+
+    async def _delay(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+    async def select(self, request):
+        await self._delay()
+        return web.json_response([{'id': index, 'page_num': index, 'materials': [], 'questions': [],
+                                   'think': None, 'answer': None, 'thinks': None} for index in range(3)])
+
+    async def update(self, request):
+        body = await request.json()
+        await self._delay()
+        page_num = int(request.query.get('page_num', 'eq.0')[3:])
+        return web.json_response([{'id': page_num, 'page_num': page_num, **body}])
+
+    def reset(self):
+        self.requests = 0
+        self.max_in_flight = 0
+
+    def start(self):
+        """在后台线程中运行，与被测的事件循环互不影响"""
+        ready = threading.Event()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_get('/rest/v1/articles', self.select)
+            app.router.add_patch('/rest/v1/articles', self.update)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            ready.set()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(serve())
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+
+
+async def blocking_execute(query):
+    """原实现：在协程中直接调用阻塞的 execute()"""
+    return query.execute()
+
+
+async def measure_loop_lag(stop, interval=0.005):
+    """定时唤醒，记录事件循环最长一次未能按时调度的时间"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_calls(writer, calls):
+    stop = asyncio.Event()
+    lag = asyncio.create_task(measure_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        writer.get_all_materials_last_questions(labelId=index) if index % 2 == 0
+        else writer.update_article_thinks_and_deep_answers(index, ['think'], ['answer'])
+        for index in range(calls)
+    ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, await lag
+
+
+def main(calls, latency, concurrency):
+    server = StubPostgrest(latency)
+    server.start()
+    os.environ['SUPABASE_URL'] = f'http://127.0.0.1:{server.port}'
+    os.environ['SUPABASE_KEY'] = STUB_KEY
+    logging.disable(logging.CRITICAL)
+
+    from supabase_articles_writer import SupabaseArticlesWriter
+
+    candidates = (
+        ('阻塞 execute（原实现）', 1, True),
+        (f'线程池执行，并发 {concurrency}', concurrency, False),
+    )
+    print(f"并发调用 {calls} 次查询/更新，单次延迟 {latency}s")
+    for label, max_concurrency, blocking in candidates:
+        server.reset()
+        writer = SupabaseArticlesWriter(max_concurrency=max_concurrency)
+        if blocking:
+            writer._execute = blocking_execute
+        try:
+            elapsed, lag = asyncio.run(run_calls(writer, calls))
+        finally:
+            writer.close()
+        print(f"  {label:<24} 耗时 {elapsed:6.2f}s, 请求 {server.requests} 次, "
+              f"服务端最大并发 {server.max_in_flight}, 事件循环最长阻塞 {lag * 1000:7.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SupabaseArticlesWriter 并发基准测试')
+    parser.add_argument('--calls', type=int, default=40, help='并发调用次数，查询和更新各占一半')
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的服务端延迟（秒）')
+    parser.add_argument('--concurrency', type=int, default=8, help='写入器线程池大小')
+    args = parser.parse_args()
+    main(args.calls, args.latency, args.concurrency)
@@ -31,6 +31,13 @@ class CommonUtil:
         else:
             return None
 
+    # 补全缺失的协议头，默认使用 https
+    @staticmethod
+    def normalize_url(url):
+        if url and not url.startswith('http://') and not url.startswith('https://'):
+            return 'https://' + url
+        return url
+
     # 根据url提取域名/path，返回为-拼接的方式
     @staticmethod
     def get_name_by_url(url):
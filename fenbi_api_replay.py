@@ -0,0 +1,186 @@
+"""
+从浏览器的 performance 日志中找出试卷页面请求的数据接口，之后直接用 HTTP 请求这些接口获取试卷，
+不再需要为每份试卷打开页面
+"""
+import base64
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# convert_json 需要的试卷字段
+PAPER_FIELDS = ('materials', 'questions', 'solutions')
+# 已发现的接口模板，跨地区、跨运行复用
+DEFAULT_API_TEMPLATE_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.fenbi_api_templates.json'
+# 接口请求超时（秒）
+DEFAULT_API_TIMEOUT = 15
+# 在响应中查找试卷字段的最大嵌套层数
+MAX_SEARCH_DEPTH = 3
+# 多个地区并发抓取时避免同时写模板文件
+_save_lock = threading.Lock()
+
+PAPER_ID_PLACEHOLDER = '{paper_id}'
+CHECK_ID_PLACEHOLDER = '{check_id}'
+
+
+def find_paper_fields(payload, depth=MAX_SEARCH_DEPTH):
+    """
+    在接口响应中查找 materials/questions/solutions，兼容字段位于顶层、data 等包装对象中，
+    或者响应本身是对象数组（与控制台输出的结构相同）的情况
+
+    Returns:
+        dict: 找到的字段及其值
+    """
+    found = {}
+    if depth < 0:
+        return found
+    if isinstance(payload, dict):
+        for field in PAPER_FIELDS:
+            if isinstance(payload.get(field), list):
+                found[field] = payload[field]
+        if found:
+            return found
+        for value in payload.values():
+            if isinstance(value, (dict, list)):
+                found = find_paper_fields(value, depth - 1)
+                if found:
+                    return found
+    elif isinstance(payload, list) and payload and isinstance(payload[0], dict):
+        return find_paper_fields(payload[0], depth - 1)
+    return found
+
+
+def _url_variants(value):
+    value = str(value)
+    return {value, quote(value, safe='')}
+
+
+def to_template(url, paper):
+    """把接口地址中的试卷 ID 和校验信息替换为占位符，无法替换时返回 None"""
+    template = url
+    for variant in sorted(_url_variants(paper['encodeCheckInfo']), key=len, reverse=True):
+        template = template.replace(variant, CHECK_ID_PLACEHOLDER)
+    for variant in _url_variants(paper['id']):
+        template = template.replace(f'/{variant}', f'/{PAPER_ID_PLACEHOLDER}')
+        template = template.replace(f'={variant}', f'={PAPER_ID_PLACEHOLDER}')
+    if PAPER_ID_PLACEHOLDER not in template and CHECK_ID_PLACEHOLDER not in template:
+        return None
+    return template
+
+
+def fill_template(template, paper):
+    return template.replace(PAPER_ID_PLACEHOLDER, str(paper['id'])) \
+        .replace(CHECK_ID_PLACEHOLDER, quote(str(paper['encodeCheckInfo']), safe=''))
+
+
+def drain_performance_logs(driver):
+    """打开新页面前清空 performance 日志缓冲区，之后读到的都是该页面的请求"""
+    try:
+        driver.get_log('performance')
+    except Exception as e:
+        logger.debug(f"读取 performance 日志失败: {str(e)}")
+
+
+def _read_response_body(driver, request_id):
+    body = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+    text = body.get('body', '')
+    if body.get('base64Encoded'):
+        text = base64.b64decode(text).decode('utf-8', errors='replace')
+    return json.loads(text)
+
+
+def discover_api_templates(driver, paper):
+    """
+    分析当前页面的 performance 日志，找出返回试卷字段的 GET 接口
+
+    Args:
+        driver: 刚打开过试卷页面的 webdriver，打开前应调用 drain_performance_logs
+        paper: 该页面对应的试卷信息（id、encodeCheckInfo）
+
+    Returns:
+        list[dict]: [{'url': 接口模板, 'fields': [该接口提供的字段]}]，
+        未能覆盖全部 PAPER_FIELDS 时返回 None
+    """
+    methods = {}
+    responses = []
+    for entry in driver.get_log('performance'):
+        try:
+            message = json.loads(entry['message'])['message']
+        except (KeyError, ValueError):
+            continue
+        params = message.get('params', {})
+        if message.get('method') == 'Network.requestWillBeSent':
+            methods[params.get('requestId')] = params.get('request', {}).get('method')
+        elif message.get('method') == 'Network.responseReceived' and params.get('type') in ('XHR', 'Fetch'):
+            responses.append((params['requestId'], params['response']['url']))
+
+    templates = []
+    covered = set()
+    for request_id, url in responses:
+        if methods.get(request_id) != 'GET':
+            continue
+        try:
+            fields = find_paper_fields(_read_response_body(driver, request_id))
+        except Exception:
+            continue
+        template = to_template(url, paper) if fields else None
+        if template and not set(fields) <= covered:
+            templates.append({'url': template, 'fields': sorted(fields)})
+            covered.update(fields)
+
+    if covered != set(PAPER_FIELDS):
+        logger.info(f"未能从页面请求中找到全部试卷接口，已找到字段: {sorted(covered)}")
+        return None
+    logger.info(f"发现试卷数据接口: {[template['url'] for template in templates]}")
+    return templates
+
+
+def load_api_templates(path=DEFAULT_API_TEMPLATE_FILE):
+    try:
+        return json.loads(Path(path).read_text(encoding='utf-8')) or None
+    except (OSError, ValueError):
+        return None
+
+
+def save_api_templates(templates, path=DEFAULT_API_TEMPLATE_FILE):
+    path = Path(path)
+    tmp_path = path.with_suffix('.tmp')
+    with _save_lock:
+        tmp_path.write_text(json.dumps(templates, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+
+class PaperApiClient:
+    """按已发现的接口模板直接请求试卷数据，共享一个带连接池的 requests.Session"""
+
+    def __init__(self, session: requests.Session, templates, timeout=DEFAULT_API_TIMEOUT):
+        self.session = session
+        self.templates = templates
+        self.timeout = timeout
+
+    def fetch(self, paper):
+        """
+        请求一份试卷的所有数据接口，合并成与控制台输出相同结构的字典
+
+        Returns:
+            dict: 包含 materials/questions/solutions 的字典，任一接口失败或字段缺失时返回 None
+        """
+        original_json = {}
+        for template in self.templates:
+            url = fill_template(template['url'], paper)
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                original_json.update(find_paper_fields(response.json()))
+            except (requests.RequestException, ValueError) as e:
+                logger.info(f"请求试卷接口失败 {url}: {str(e)}")
+                return None
+        if not all(field in original_json for field in PAPER_FIELDS):
+            return None
+        return original_json
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 历史回填进度文件，按地区记录已经处理完成的列表页
+DEFAULT_CHECKPOINT_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.fenbi_backfill.json'
+
+
+class BackfillCheckpoint:
+    """
+    历史回填的断点记录：某一列表页的试卷全部处理完后记下该页，
+    中断后再次回填时跳过已完成的页；多个地区的线程可以共用一个实例
+
+    列表按发布时间倒序，有新试卷发布时所有页整体后移，已完成的页码不再对应原来的试卷，
+    因此只在试卷总数与记录时相同时沿用已完成的页，否则清空重新扫描（已入库的试卷由数据库过滤）
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.labels = {}
+        if self.path.exists():
+            try:
+                self.labels = json.loads(self.path.read_text(encoding='utf-8'))
+            except ValueError:
+                logger.warning(f"回填进度文件 {self.path} 损坏，将从头开始回填")
+
+    def done_pages(self, label_id):
+        with self._lock:
+            return set(self.labels.get(str(label_id), {}).get('done_pages', []))
+
+    def set_total_pages(self, label_id, total_pages, total_papers=None):
+        """
+        每次回填开始时调用；total_papers 为列表接口返回的试卷总数，
+        与上次不同或无法得知时清空该地区已完成的页
+        """
+        with self._lock:
+            entry = self.labels.setdefault(str(label_id), {})
+            if entry.get('done_pages') and (total_papers is None or entry.get('total_papers') != total_papers):
+                logger.info(f"地区 {label_id} 试卷总数由 {entry.get('total_papers')} 变为 {total_papers}，"
+                            f"页码已偏移，重新扫描全部列表页")
+                entry['done_pages'] = []
+            entry['total_pages'] = total_pages
+            entry['total_papers'] = total_papers
+            self._save()
+
+    def mark_done(self, label_id, page):
+        """该页所有试卷处理完成后调用，立即写入文件"""
+        with self._lock:
+            entry = self.labels.setdefault(str(label_id), {})
+            done_pages = set(entry.get('done_pages', []))
+            done_pages.add(page)
+            entry['done_pages'] = sorted(done_pages)
+            entry['updated_at'] = int(time.time())
+            self._save()
+
+    def is_complete(self, label_id):
+        with self._lock:
+            entry = self.labels.get(str(label_id), {})
+            total_pages = entry.get('total_pages')
+            return total_pages is not None and len(entry.get('done_pages', [])) >= total_pages
+
+    def _save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.labels, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
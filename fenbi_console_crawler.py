@@ -2,19 +2,106 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+import argparse
 import logging
+import os
+import random
+import threading
 import time
 import json
-from supabase_articles_writer import SupabaseArticlesWriter
-import asyncio
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from fenbi_ingest_pipeline import OUTCOME_FAILED, ArticleIngestPipeline
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logger_base import LoggerBase
 import requests
+from fenbi_backfill_checkpoint import BackfillCheckpoint
+from fenbi_api_replay import (PaperApiClient, discover_api_templates, drain_performance_logs, load_api_templates,
+                              save_api_templates)
+
+# 等待试卷数据出现在控制台的最长时间（秒）
+DEFAULT_CAPTURE_TIMEOUT = 10
+# 轮询 console.logs 的间隔（秒）
+DEFAULT_POLL_INTERVAL = 0.2
+# 相邻两次请求试卷的最小间隔和随机抖动（秒）
+DEFAULT_MIN_INTERVAL = 3.0
+DEFAULT_JITTER = 2.0
+# 多地区并发抓取时的工作线程数，每个线程持有一个浏览器
+DEFAULT_WORKERS = 4
+# 多地区并发抓取时所有线程合计每秒最多发起的请求数
+DEFAULT_REQUESTS_PER_SECOND = 1.0
+# 回填时并发请求列表页的线程数
+DEFAULT_LIST_WORKERS = 4
+# 每个浏览器打开多少个页面后重启，限制内存增长
+DEFAULT_DRIVER_MAX_PAGES = 200
+# 持久化的 cookie，保存浏览器和接口响应中更新过的 cookie，下次运行继续使用
+DEFAULT_COOKIE_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.fenbi_cookies.json'
+# 粉笔 cookie 统一记录的域名
+COOKIE_DOMAIN = '.fenbi.com'
+
+COOKIE_STRING = 'sid=2324896; persistent=oMIwhl22q4RhXbaKYXdyqGkwB6WgmtWUWeqtSsRKUxhKCwdU2UxZCCM0u1+1GLoUbl+ntKmozzhE438rEEZsug==; sensorsdata2015jssdkcross=%7B%22distinct_id%22%3A%22191f8b69e487fe-0fc5b4d9b91081-15313374-2073600-191f8b69e498bd%22%2C%22first_id%22%3A%22%22%2C%22props%22%3A%7B%22%24latest_traffic_source_type%22%3A%22%E7%9B%B4%E6%8E%A5%E6%B5%81%E9%87%8F%22%2C%22%24latest_search_keyword%22%3A%22%E6%9C%AA%E5%8F%96%E5%88%B0%E5%80%BC_%E7%9B%B4%E6%8E%A5%E6%89%93%E5%BC%80%22%2C%22%24latest_referrer%22%3A%22%22%7D%2C%22identities%22%3A%22eyIkaWRlbnRpdHlfY29va2llX2lkIjoiMTkxZjhiNjllNDg3ZmUtMGZjNWI0ZDliOTEwODEtMTUzMTMzNzQtMjA3MzYwMC0xOTFmOGI2OWU0OThiZCJ9%22%2C%22history_login_id%22%3A%7B%22name%22%3A%22%22%2C%22value%22%3A%22%22%7D%2C%22%24device_id%22%3A%22191f8b69e487fe-0fc5b4d9b91081-15313374-2073600-191f8b69e498bd%22%7D; acw_tc=0b6e704217394347214193465eaf0e29dfb0a7c67910902258a65841e31560; sess=11qnYqL/5HBUzd/JWa4ZGvYdy+3nX81cAvxACdAbKnEYvdcd8wPN9PtXqPrUbAWva8x8OMqPOctAh2cIOcscQGwVL9hkkV2oUFk4yNFzd5Y=; userid=122460950'
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Cookie': COOKIE_STRING,
+    'Accept': 'application/json',
+    'Referer': 'https://spa.fenbi.com/',
+    'Origin': 'https://spa.fenbi.com'
+}
+
+# 拦截 console.log，把第一个参数为数组的调用保存到 console.logs；
+# 重复执行不会清空已经收集到的数据
+CONSOLE_HOOK_SCRIPT = """
+    if (!console.logs) {
+        console.defaultLog = console.log.bind(console);
+        console.logs = [];
+        console.log = function(){
+            console.defaultLog.apply(console, arguments);
+            if (arguments.length > 0 && Array.isArray(arguments[0])) {
+                console.logs.push(Array.from(arguments));
+            }
+        }
+    }
+"""
+
+# 已经输出试卷数据（含 questions 的对象数组）时返回 console.logs，否则返回 null
+CONSOLE_PAPERS_SCRIPT = """
+    var logs = console.logs || [];
+    var found = logs.some(function(log) {
+        return Array.isArray(log[0]) && log[0].length > 0 && log[0][0] && log[0][0].questions;
+    });
+    return found ? logs : null;
+"""
+
+
+class PolitenessPolicy:
+    """
+    控制请求试卷的频率：相邻两次请求至少间隔 min_interval 秒，再加上随机抖动，
+    处理试卷本身花费的时间计入间隔，多个线程共用同一个实例时整体遵守该频率
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, jitter=DEFAULT_JITTER):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        """阻塞到允许发起下一次请求，返回实际等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.min_interval + random.uniform(0, self.jitter)
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
 
 
 def setup_logger():
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s'
+        format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s'
     )
     return logging.getLogger(__name__)
 
@@ -42,9 +129,46 @@ def create_headless_driver():
         service=service,
         options=chrome_options
     )
+    install_console_hook(driver)
     return driver
 
 
+def install_console_hook(driver):
+    """在每个页面的脚本执行前注入 console.log 拦截，避免错过页面加载过程中输出的数据"""
+    try:
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': CONSOLE_HOOK_SCRIPT})
+    except Exception as e:
+        logging.warning(f"注入 console.log 拦截失败，将在页面加载后注入: {str(e)}")
+
+
+def wait_for_console_papers(driver, timeout=DEFAULT_CAPTURE_TIMEOUT, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    轮询 console.logs，试卷数据一出现就立即返回，不再固定等待
+
+    Returns:
+        list: 收集到的控制台日志，超时返回空列表
+    """
+    # 未能提前注入时补充注入，脚本可重复执行
+    driver.execute_script(CONSOLE_HOOK_SCRIPT)
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=poll_interval).until(
+            lambda d: d.execute_script(CONSOLE_PAPERS_SCRIPT)
+        )
+    except TimeoutException:
+        return []
+
+
+def log_capture_stats(logger, latencies, timeouts):
+    """输出每份试卷从打开页面到拿到数据的耗时统计"""
+    if not latencies:
+        return
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    logger.info(f"捕获耗时: {len(latencies)} 份试卷, 平均 {sum(latencies) / len(latencies):.2f} 秒, "
+                f"中位数 {ordered[len(ordered) // 2]:.2f} 秒, P95 {p95:.2f} 秒, 最长 {ordered[-1]:.2f} 秒, "
+                f"超时 {timeouts} 份")
+
+
 def add_cookies(driver, cookie_string):
     # 首先访问目标域名，否则无法设置cookie
     driver.get('https://spa.fenbi.com')
@@ -79,134 +203,346 @@ def convert_json(original_json):
         return None
 
 
-async def process_article_data(labelId, simplified, article_data: dict):
+def build_article_record(labelId, simplified, article_data: dict):
+    """把 convert_json 的结果转换为 articles 表的一行"""
+    return {
+        'labelId': labelId,
+        'topic': simplified['topic'],
+        'page_num': simplified['id'],
+        'name': article_data['name'],
+        'materials': article_data['materials'],
+        'questions': article_data['questions'],
+        'solutions': article_data['solutions'],
+        'last_question': article_data['last_question'],
+    }
+
+
+class CrawlerSession:
+    """
+    整个抓取过程共用的会话：一个带连接池和持久化 cookie 的 requests.Session，以及按需创建的浏览器。
+    多线程抓取时每个线程持有自己的浏览器，浏览器打开 max_pages 个页面后自动重启
+
+    用法:
+        with CrawlerSession() as crawler_session:
+            crawler_session.http.get(url)
+            driver = crawler_session.get_driver()  # 每次打开页面前调用
+    """
+
+    def __init__(self, max_pages=DEFAULT_DRIVER_MAX_PAGES, cookie_file=DEFAULT_COOKIE_FILE,
+                 pool_size=DEFAULT_WORKERS * DEFAULT_LIST_WORKERS):
+        self.max_pages = max_pages
+        self.cookie_file = Path(cookie_file) if cookie_file else None
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, pool_size))
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        # cookie 交给 cookie jar 管理，响应中更新的 cookie 会自动带到后续请求
+        self.http.headers.update({key: value for key, value in HEADERS.items() if key != 'Cookie'})
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+        self._load_cookies()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _load_cookies(self):
+        for pair in COOKIE_STRING.split(';'):
+            if '=' in pair:
+                name, value = pair.strip().split('=', 1)
+                self._set_cookie(name, value)
+        if not self.cookie_file or not self.cookie_file.exists():
+            return
+        try:
+            for cookie in json.loads(self.cookie_file.read_text(encoding='utf-8')):
+                self._set_cookie(cookie['name'], cookie['value'], cookie['domain'], cookie['path'])
+        except (ValueError, KeyError) as e:
+            logging.warning(f"读取 cookie 文件失败: {str(e)}")
+
+    def _set_cookie(self, name, value, domain=COOKIE_DOMAIN, path='/'):
+        """
+        粉笔的 cookie 统一记在 COOKIE_DOMAIN 下，并先删除其他域名下的同名 cookie，
+        否则浏览器按 tiku.fenbi.com 等域名写回的 cookie 会与原有的并存，请求时同时发出新旧两个值
+        """
+        if domain.lstrip('.').endswith(COOKIE_DOMAIN.lstrip('.')):
+            domain, path = COOKIE_DOMAIN, '/'
+        with self._lock:
+            for cookie in [cookie for cookie in self.http.cookies if cookie.name == name]:
+                if cookie.domain.lstrip('.').endswith(COOKIE_DOMAIN.lstrip('.')) or cookie.domain == domain:
+                    self.http.cookies.clear(cookie.domain, cookie.path, cookie.name)
+            self.http.cookies.set(name, value, domain=domain, path=path)
+
+    def save_cookies(self):
+        if not self.cookie_file:
+            return
+        cookies = [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path}
+                   for cookie in self.http.cookies]
+        tmp_path = self.cookie_file.with_suffix('.tmp')
+        with self._lock:
+            tmp_path.write_text(json.dumps(cookies, ensure_ascii=False, indent=2), encoding='utf-8')
+            os.replace(tmp_path, self.cookie_file)
+
+    def cookie_string(self):
+        return '; '.join(f'{cookie.name}={cookie.value}' for cookie in self.http.cookies
+                         if cookie.domain.lstrip('.').endswith('fenbi.com'))
+
+    def sync_cookies_from(self, driver):
+        """把浏览器中更新过的 cookie 同步到 HTTP 会话"""
+        for cookie in driver.get_cookies():
+            self._set_cookie(cookie['name'], cookie['value'], cookie.get('domain', COOKIE_DOMAIN), cookie.get('path', '/'))
+
+    def get_driver(self):
+        """返回当前线程的浏览器，每次打开页面前调用；累计打开 max_pages 个页面后重启"""
+        driver = getattr(self._local, 'driver', None)
+        if driver is not None and self._local.pages >= self.max_pages:
+            logging.info(f"浏览器已打开 {self._local.pages} 个页面，重启浏览器")
+            self._quit_driver(driver)
+            driver = None
+        if driver is None:
+            driver = create_headless_driver()
+            add_cookies(driver, self.cookie_string())
+            self._local.driver = driver
+            self._local.pages = 0
+            with self._lock:
+                self._drivers.append(driver)
+        self._local.pages += 1
+        return driver
+
+    def _quit_driver(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+        self._local.driver = None
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"关闭浏览器失败: {str(e)}")
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        if drivers:
+            logging.info(f"关闭 {len(drivers)} 个浏览器...")
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logging.warning(f"关闭浏览器失败: {str(e)}")
+        self.save_cookies()
+        self.http.close()
+
+
+def fetch_existing_page_nums(pipeline, page_nums):
+    """批量查询已入库的试卷 ID，数据库不可用时返回空集合，不影响抓取"""
     try:
-        writer = SupabaseArticlesWriter()
-        insert_data = {
-            'labelId': labelId,
-            'topic': simplified['topic'],
-            'page_num': simplified['id'],
-            'name': article_data['name'],
-            'materials': article_data['materials'],
-            'questions': article_data['questions'],
-            'solutions': article_data['solutions'],
-            'last_question': article_data['last_question'],
-        }
-        result = await writer.insert_article(insert_data)
-        if result:
-            logging.info(f"成功保存文章到数据库，ID: {result.get('id')}")
-        return result
+        return pipeline.existing_page_nums(page_nums)
     except Exception as e:
-        logging.error(f"保存文章到数据库时出错: {str(e)}")
-        raise
-
-
-def get_list(labelId):
+        logging.warning(f"查询已入库试卷失败，将处理全部试卷: {str(e)}")
+        return set()
+
+
+def fetch_list_page(session, labelId, page, politeness):
+    """请求一页试卷列表"""
+    page_url = f'https://tiku.fenbi.com/api/shenlun/papers?labelId={labelId}&toPage={page}&kav=100&av=100&hav=100&app=web'
+    politeness.wait()
+    response = session.get(page_url)
+    response.raise_for_status()
+    return response.json()
+
+
+def parse_papers(page_data):
+    """提取列表页中的试卷信息"""
+    return [{
+        'topic': item['topic'],
+        'name': item['name'],
+        'id': item['id'],
+        'encodeCheckInfo': item['encodeCheckInfo']
+    } for item in page_data['list']]
+
+
+def get_list(labelId, capture_timeout=DEFAULT_CAPTURE_TIMEOUT, politeness=None, http_mode=True, crawler_session=None,
+             backfill=False, checkpoint=None, list_workers=DEFAULT_LIST_WORKERS, skip_existing=True, pipeline=None):
+    """
+    抓取一个地区的试卷并写入数据库，默认只取第一页的最新数据
+
+    Args:
+        labelId: 地区标签 ID
+        capture_timeout: 等待试卷数据出现在控制台的最长时间（秒）
+        politeness: 控制请求频率的 PolitenessPolicy，多个地区可共用一个实例
+        http_mode: 为 True 时直接请求试卷数据接口，浏览器仅作为兜底并用于发现接口
+        crawler_session: 共用的 CrawlerSession，由调用方负责关闭；不传时创建一个并在结束时关闭
+        backfill: 为 True 时按 pageInfo.totalPage 回填全部历史试卷，并按页记录断点
+        checkpoint: 回填断点记录 BackfillCheckpoint，多个地区并发回填时应共用一个实例
+        list_workers: 回填时并发请求列表页的线程数
+        skip_existing: 为 True 时在打开页面前批量查询数据库，跳过已入库的试卷
+        pipeline: 共用的 ArticleIngestPipeline，由调用方负责关闭；不传时创建一个并在结束时写完关闭
+    """
+    politeness = politeness or PolitenessPolicy()
+    if backfill and checkpoint is None:
+        checkpoint = BackfillCheckpoint()
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = ArticleIngestPipeline()
+        pipeline.start()
+    own_session = crawler_session is None
+    crawler_session = crawler_session or CrawlerSession()
+    # 列表和试卷接口共用一个连接池
+    session = crawler_session.http
     try:
         logger = setup_logger()
-        driver = None
         all_papers = []  # 存储所有页面的试卷数据
-
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-                'Cookie': 'sid=2324896; persistent=oMIwhl22q4RhXbaKYXdyqGkwB6WgmtWUWeqtSsRKUxhKCwdU2UxZCCM0u1+1GLoUbl+ntKmozzhE438rEEZsug==; sensorsdata2015jssdkcross=%7B%22distinct_id%22%3A%22191f8b69e487fe-0fc5b4d9b91081-15313374-2073600-191f8b69e498bd%22%2C%22first_id%22%3A%22%22%2C%22props%22%3A%7B%22%24latest_traffic_source_type%22%3A%22%E7%9B%B4%E6%8E%A5%E6%B5%81%E9%87%8F%22%2C%22%24latest_search_keyword%22%3A%22%E6%9C%AA%E5%8F%96%E5%88%B0%E5%80%BC_%E7%9B%B4%E6%8E%A5%E6%89%93%E5%BC%80%22%2C%22%24latest_referrer%22%3A%22%22%7D%2C%22identities%22%3A%22eyIkaWRlbnRpdHlfY29va2llX2lkIjoiMTkxZjhiNjllNDg3ZmUtMGZjNWI0ZDliOTEwODEtMTUzMTMzNzQtMjA3MzYwMC0xOTFmOGI2OWU0OThiZCJ9%22%2C%22history_login_id%22%3A%7B%22name%22%3A%22%22%2C%22value%22%3A%22%22%7D%2C%22%24device_id%22%3A%22191f8b69e487fe-0fc5b4d9b91081-15313374-2073600-191f8b69e498bd%22%7D; acw_tc=0b6e704217394347214193465eaf0e29dfb0a7c67910902258a65841e31560; sess=11qnYqL/5HBUzd/JWa4ZGvYdy+3nX81cAvxACdAbKnEYvdcd8wPN9PtXqPrUbAWva8x8OMqPOctAh2cIOcscQGwVL9hkkV2oUFk4yNFzd5Y=; userid=122460950',
-                'Accept': 'application/json',
-                'Referer': 'https://spa.fenbi.com/',
-                'Origin': 'https://spa.fenbi.com'
-            }
-
             first_page = 0
-            first_page_url = f'https://tiku.fenbi.com/api/shenlun/papers?labelId={labelId}&toPage={first_page}&kav=100&av=100&hav=100&app=web'
-            response = requests.get(first_page_url, headers=headers)
-            response.raise_for_status()
-            first_page_data = response.json()
-
-            # total_pages = first_page_data['pageInfo']['totalPage']
-            # 只取第一页的最新数据
-            total_pages = 1
-            logger.info(f"从第 {first_page + 1} 页开始，总页数: {total_pages}")
-
-            # 处理所有页面的数据
-            for page in range(first_page, total_pages):
-                logger.info(f"正在获取第 {page + 1}/{total_pages} 页数据")
-
-                if page == first_page:
-                    page_data = first_page_data
-                else:
-                    page_url = f'https://tiku.fenbi.com/api/shenlun/papers?labelId={labelId}&toPage={page}&kav=100&av=100&hav=100&app=web'
-                    response = requests.get(page_url, headers=headers)
-                    response.raise_for_status()
-                    page_data = response.json()
-
-                # 提取当前页的试卷列表
-                current_page_papers = [{
-                    'topic': item['topic'],
-                    'name': item['name'],
-                    'id': item['id'],
-                    'encodeCheckInfo': item['encodeCheckInfo']
-                } for item in page_data['list']]
-
+            first_page_data = fetch_list_page(session, labelId, first_page, politeness)
+
+            if backfill:
+                # 回填全部历史试卷，跳过断点记录中已经处理完成的页
+                total_pages = first_page_data['pageInfo']['totalPage']
+                checkpoint.set_total_pages(labelId, total_pages, first_page_data['pageInfo'].get('total'))
+                done_pages = checkpoint.done_pages(labelId)
+            else:
+                # 只取第一页的最新数据
+                total_pages = 1
+                done_pages = set()
+            pages = [page for page in range(first_page, total_pages) if page not in done_pages]
+            logger.info(f"总页数: {total_pages}，已完成 {len(done_pages)} 页，本次处理 {len(pages)} 页")
+
+            page_datas = {first_page: first_page_data}
+            other_pages = [page for page in pages if page != first_page]
+            if other_pages:
+                # 其余列表页通过同一个 keep-alive 会话并发请求，频率仍由 politeness 控制
+                with ThreadPoolExecutor(max_workers=max(1, list_workers)) as executor:
+                    futures = {
+                        executor.submit(fetch_list_page, session, labelId, page, politeness): page
+                        for page in other_pages
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            page_datas[futures[future]] = future.result()
+                        except (requests.RequestException, ValueError) as e:
+                            # 未完成的页不记入断点，下次回填时重试
+                            logger.error(f"获取第 {futures[future] + 1} 页数据失败: {str(e)}")
+
+            paper_pages = []
+            for page in pages:
+                if page not in page_datas:
+                    continue
+                current_page_papers = parse_papers(page_datas[page])
                 all_papers.extend(current_page_papers)
+                paper_pages.extend([page] * len(current_page_papers))
                 logger.info(f"第 {page + 1} 页获取到 {len(current_page_papers)} 份试卷")
 
-                # 如果不是最后一页，等待一小段时间再请求下一页
-                if page < total_pages - 1:
-                    time.sleep(2)  # 添加2秒延迟，避免请求过于频繁
-
             logger.info(f"共获取到 {len(all_papers)} 份试卷信息")
 
-            # 创建一个共享的浏览器实例
-            driver = create_headless_driver()
-            cookie_string = 'sid=2324896; persistent=oMIwhl22q4RhXbaKYXdyqGkwB6WgmtWUWeqtSsRKUxhKCwdU2UxZCCM0u1+1GLoUbl+ntKmozzhE438rEEZsug==; sensorsdata2015jssdkcross=%7B%22distinct_id%22%3A%22191f8b69e487fe-0fc5b4d9b91081-15313374-2073600-191f8b69e498bd%22%2C%22first_id%22%3A%22%22%2C%22props%22%3A%7B%22%24latest_traffic_source_type%22%3A%22%E7%9B%B4%E6%8E%A5%E6%B5%81%E9%87%8F%22%2C%22%24latest_search_keyword%22%3A%22%E6%9C%AA%E5%8F%96%E5%88%B0%E5%80%BC_%E7%9B%B4%E6%8E%A5%E6%89%93%E5%BC%80%22%2C%22%24latest_referrer%22%3A%22%22%7D%2C%22identities%22%3A%22eyIkaWRlbnRpdHlfY29va2llX2lkIjoiMTkxZjhiNjllNDg3ZmUtMGZjNWI0ZDliOTEwODEtMTUzMTMzNzQtMjA3MzYwMC0xOTFmOGI2OWU0OThiZCJ9%22%2C%22history_login_id%22%3A%7B%22name%22%3A%22%22%2C%22value%22%3A%22%22%7D%2C%22%24device_id%22%3A%22191f8b69e487fe-0fc5b4d9b91081-15313374-2073600-191f8b69e498bd%22%7D; acw_tc=0b6e704217394347214193465eaf0e29dfb0a7c67910902258a65841e31560; sess=11qnYqL/5HBUzd/JWa4ZGvYdy+3nX81cAvxACdAbKnEYvdcd8wPN9PtXqPrUbAWva8x8OMqPOctAh2cIOcscQGwVL9hkkV2oUFk4yNFzd5Y=; userid=122460950'
-            add_cookies(driver, cookie_string)
-
+            if skip_existing and all_papers:
+                # 打开页面前一次查出已经入库的试卷并跳过
+                existing = fetch_existing_page_nums(pipeline, [paper['id'] for paper in all_papers])
+                if existing:
+                    kept = [(paper, page) for paper, page in zip(all_papers, paper_pages) if paper['id'] not in existing]
+                    all_papers = [paper for paper, _ in kept]
+                    paper_pages = [page for _, page in kept]
+                    logger.info(f"{len(existing)} 份试卷已入库，跳过；待处理 {len(all_papers)} 份")
+
+            # 记录每一页最后一份待处理试卷的位置，处理到该位置时该页完成
+            page_last_index = {page: index for index, page in enumerate(paper_pages)}
+            if backfill:
+                for page in pages:
+                    if page in page_datas and page not in page_last_index:
+                        checkpoint.mark_done(labelId, page)
+
+            # HTTP 模式下优先直接请求已发现的试卷接口，浏览器只在接口未知或请求失败时使用
+            templates = load_api_templates() if http_mode else None
+            api_client = PaperApiClient(session, templates) if templates else None
+
+            latencies = []
+            timeouts = 0
+            sources = {'http': 0, 'browser': 0}
+            page_writes = []
+            # 当前页是否有试卷未获取到，有则该页不记入断点，下次回填时重试
+            page_failed = False
             for index, simplified in enumerate(all_papers):
                 try:
                     logger.info(f"正在处理第 {index + 1}/{len(all_papers)} 个试卷: {simplified['name']}")
-
-                    target_url = f'https://spa.fenbi.com/shenlun/zhenti/shenlun/{simplified["id"]}?checkId={simplified["encodeCheckInfo"]}'
-                    driver.get(target_url)
-
-                    WebDriverWait(driver, 8).until(
-                        lambda d: d.execute_script('return document.readyState') == 'complete'
-                    )
-
-                    driver.execute_script("""
-                        console.defaultLog = console.log.bind(console);
-                        console.logs = [];
-                        console.log = function(){
-                            console.defaultLog.apply(console, arguments);
-                            if (arguments.length > 0 && Array.isArray(arguments[0])) {
-                                console.logs.push(Array.from(arguments));
-                            }
-                        }
-                    """)
-
-                    # 等待一段时间以收集日志
-                    time.sleep(5)
-
-                    console_logs = driver.execute_script("return console.logs")
-                    if console_logs:
+                    politeness.wait()
+                    start_time = time.monotonic()
+
+                    papers = []
+                    if api_client:
+                        original_json = api_client.fetch(simplified)
+                        optimized_data = convert_json(original_json) if original_json else None
+                        if optimized_data:
+                            papers.append(optimized_data)
+                            sources['http'] += 1
+                        else:
+                            logger.info("通过接口获取试卷失败，改用浏览器")
+
+                    if not papers:
+                        # 浏览器只在需要时启动，并按打开的页面数定期重启
+                        driver = crawler_session.get_driver()
+                        if http_mode:
+                            drain_performance_logs(driver)
+
+                        target_url = f'https://spa.fenbi.com/shenlun/zhenti/shenlun/{simplified["id"]}?checkId={simplified["encodeCheckInfo"]}'
+                        driver.get(target_url)
+
+                        # 试卷数据一出现就返回，超过 capture_timeout 仍没有数据则跳过
+                        console_logs = wait_for_console_papers(driver, capture_timeout)
                         for log in console_logs:
                             if log and len(log) > 0 and isinstance(log[0], list):
                                 optimized_data = convert_json(log[0][0])
                                 if optimized_data:
-                                    formatted_json = json.dumps(optimized_data, ensure_ascii=False, indent=2)
-                                    print(f"阅读所有materials ，根据last_question的要求作答\n{formatted_json}")
-                                    asyncio.run(process_article_data(labelId, simplified, optimized_data))
+                                    papers.append(optimized_data)
+                        if papers:
+                            sources['browser'] += 1
+                            crawler_session.sync_cookies_from(driver)
+                        if papers and http_mode:
+                            # 从本次页面加载的请求中重新发现接口，之后的试卷直接走 HTTP
+                            templates = discover_api_templates(driver, simplified)
+                            if templates:
+                                save_api_templates(templates)
+                                api_client = PaperApiClient(session, templates)
+
+                    latency = time.monotonic() - start_time
+                    if papers:
+                        latencies.append(latency)
+                        logger.info(f"获取试卷数据耗时 {latency:.2f} 秒")
                     else:
-                        logger.info("没有发现控制台输出")
+                        timeouts += 1
+                        page_failed = True
+                        logger.info(f"{latency:.2f} 秒内未获取到试卷数据")
 
-                    # 在每次循环结束后等待15秒
-                    if index < len(all_papers) - 1:  # 如果不是最后一个元素
-                        logger.info("等待15秒后处理下一个试卷...")
-                        time.sleep(15)
+                    for optimized_data in papers:
+                        formatted_json = json.dumps(optimized_data, ensure_ascii=False, indent=2)
+                        print(f"阅读所有materials ，根据last_question的要求作答\n{formatted_json}")
+                        # 交给入库流水线攒批写入，不阻塞抓取
+                        page_writes.append(pipeline.submit(build_article_record(labelId, simplified, optimized_data)))
 
                 except Exception as e:
+                    page_failed = True
                     logger.error(f"处理试卷 {simplified['name']} 时发生错误: {str(e)}")
-                    continue
 
+                if backfill and page_last_index.get(paper_pages[index]) == index:
+                    # 该页的文章都成功写入后才记入断点，写入失败或中断时下次回填重试
+                    if any(write.result() == OUTCOME_FAILED for write in page_writes):
+                        page_failed = True
+                    page_writes = []
+                    if page_failed:
+                        logger.info(f"第 {paper_pages[index] + 1} 页有试卷未获取到或未能入库，不记入断点，下次回填时重试")
+                    else:
+                        checkpoint.mark_done(labelId, paper_pages[index])
+                    page_failed = False
+
+            log_capture_stats(logger, latencies, timeouts)
+            logger.info(f"接口获取 {sources['http']} 份, 浏览器获取 {sources['browser']} 份")
+            if backfill:
+                if checkpoint.is_complete(labelId):
+                    logger.info(f"地区 {labelId} 的 {total_pages} 页历史试卷已全部回填")
+                else:
+                    logger.info(f"地区 {labelId} 已回填 {len(checkpoint.done_pages(labelId))}/{total_pages} 页，"
+                                f"再次运行 --backfill 继续")
             return all_papers
 
         except requests.RequestException as e:
@@ -217,9 +553,60 @@ def get_list(labelId):
             return None
 
     finally:
-        if driver:
-            logger.info("关闭浏览器...")
-            driver.quit()
+        if own_session:
+            crawler_session.close()
+        if own_pipeline:
+            pipeline.close()
+
+
+def crawl_provinces(label_ids, workers=DEFAULT_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, **options):
+    """
+    多个地区并发抓取：所有线程共用一个 CrawlerSession（HTTP 连接池、cookie，每个线程一个浏览器并在地区之间复用）、
+    一个 ArticleIngestPipeline，以及一个 PolitenessPolicy，合计请求频率不超过 requests_per_second
+
+    Args:
+        label_ids: 地区标签 ID 列表
+        workers: 工作线程数
+        requests_per_second: 所有线程合计每秒最多发起的请求数
+        options: 传给 get_list 的其他参数
+
+    Returns:
+        dict: 地区标签 ID -> get_list 的返回值
+    """
+    logger = setup_logger()
+    politeness = PolitenessPolicy(1 / requests_per_second, jitter=0.5 / requests_per_second)
+    if options.get('backfill') and options.get('checkpoint') is None:
+        # 所有地区共用一个断点记录，避免并发写文件互相覆盖
+        options['checkpoint'] = BackfillCheckpoint()
+    # 所有地区共用一个 HTTP 连接池和 cookie，每个工作线程持有一个浏览器
+    crawler_session = CrawlerSession(pool_size=max(1, workers) * options.get('list_workers', DEFAULT_LIST_WORKERS))
+    # 所有地区共用一个入库流水线：一个事件循环、一个数据库客户端
+    pipeline = ArticleIngestPipeline()
+    pipeline.start()
+
+    start_time = time.monotonic()
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='fenbi') as executor:
+            futures = {
+                executor.submit(get_list, label_id, politeness=politeness, crawler_session=crawler_session,
+                                pipeline=pipeline, **options): label_id
+                for label_id in label_ids
+            }
+            for future in as_completed(futures):
+                label_id = futures[future]
+                try:
+                    results[label_id] = future.result()
+                except Exception as e:
+                    logger.error(f"抓取地区 {label_id} 时发生错误: {str(e)}")
+                    results[label_id] = None
+    finally:
+        crawler_session.close()
+        pipeline.close()
+
+    failed = [label_id for label_id, papers in results.items() if papers is None]
+    logger.info(f"{len(label_ids)} 个地区抓取完成，耗时 {time.monotonic() - start_time:.1f} 秒，失败 {len(failed)} 个: {failed}")
+    return results
 
 
 if __name__ == "__main__":
@@ -262,5 +649,11 @@ if __name__ == "__main__":
         '3591',  # 选调生
         '2894'  # 公安
     ]
-    for province_code in province_strings:
-      get_list(province_code)
+    parser = argparse.ArgumentParser(description='粉笔申论试卷抓取')
+    parser.add_argument('--backfill', action='store_true', help='回填全部历史试卷，中断后再次运行会从断点继续')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='同时抓取的地区数')
+    parser.add_argument('--rps', type=float, default=DEFAULT_REQUESTS_PER_SECOND, help='所有线程合计每秒最多请求数')
+    args = parser.parse_args()
+
+    # 多个地区并发抓取，所有线程共用一个全局请求频率限制
+    crawl_provinces(province_strings, workers=args.workers, requests_per_second=args.rps, backfill=args.backfill)
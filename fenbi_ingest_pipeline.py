@@ -0,0 +1,151 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+from supabase_articles_writer import (OUTCOME_FAILED, OUTCOME_INSERTED, OUTCOME_SKIPPED,
+                                      SupabaseArticlesWriter)
+
+logger = logging.getLogger(__name__)
+
+# 攒够多少篇文章写入一次
+DEFAULT_INGEST_BATCH_SIZE = 20
+# 第一篇文章进入批次后最多等待多久写入（秒）
+DEFAULT_INGEST_FLUSH_INTERVAL = 5.0
+# 待写入队列长度，队列满时抓取线程会等待
+DEFAULT_INGEST_QUEUE_SIZE = 100
+
+
+class ArticleIngestPipeline:
+    """
+    文章入库流水线：在一个后台线程中运行唯一的事件循环，持有一个 SupabaseArticlesWriter，
+    抓取线程通过 submit 把记录放入队列，常驻的写入任务按条数或等待时间攒批，通过 insert_articles 一次请求写入一批，抓取与入库同时进行
+
+    用法:
+        with ArticleIngestPipeline() as pipeline:
+            future = pipeline.submit(record)  # 可在任意线程调用
+            future.result()                   # 需要确认写入结果时等待
+    """
+
+    def __init__(self, writer_factory=SupabaseArticlesWriter, batch_size=DEFAULT_INGEST_BATCH_SIZE,
+                 flush_interval=DEFAULT_INGEST_FLUSH_INTERVAL, queue_size=DEFAULT_INGEST_QUEUE_SIZE):
+        """
+        Args:
+            writer_factory: 创建写入器的函数，在事件循环中调用一次
+            batch_size: 攒够多少篇文章写入一次
+            flush_interval: 第一篇文章进入批次后最多等待多久写入（秒）
+            queue_size: 待写入队列长度
+        """
+        self.writer_factory = writer_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.writer = None
+        self.stats = {OUTCOME_INSERTED: 0, OUTCOME_SKIPPED: 0, OUTCOME_FAILED: 0}
+        self._loop = None
+        self._thread = None
+        self._queue = None
+        self._task = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='ingest', daemon=True)
+        self._thread.start()
+        try:
+            self._call(self._setup())
+        except Exception:
+            self._stop_loop()
+            raise
+
+    def close(self):
+        """写完队列中剩余的文章后停止事件循环"""
+        if self._loop is None:
+            return
+        try:
+            self._call(self._shutdown())
+        finally:
+            self._stop_loop()
+        logger.info(f"文章入库完成: 新增 {self.stats[OUTCOME_INSERTED]} 篇, 已存在跳过 {self.stats[OUTCOME_SKIPPED]} 篇, "
+                    f"失败 {self.stats[OUTCOME_FAILED]} 篇")
+
+    def submit(self, record) -> concurrent.futures.Future:
+        """
+        提交一篇文章，线程安全，队列满时阻塞
+
+        Returns:
+            concurrent.futures.Future: 写入完成后结果为 inserted/skipped/failed
+        """
+        outcome = concurrent.futures.Future()
+        self._call(self._queue.put((record, outcome)))
+        return outcome
+
+    def existing_page_nums(self, page_nums):
+        """在流水线的事件循环中批量查询已入库的 page_num，线程安全"""
+        return self._call(self.writer.get_existing_page_nums(page_nums))
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _setup(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self.writer = self.writer_factory()
+        self._task = asyncio.create_task(self._run())
+
+    async def _shutdown(self):
+        await self._queue.put(None)
+        await self._task
+        self.writer.close()
+
+    async def _collect_batch(self):
+        """返回 (批次, 是否已收到结束标记)"""
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        while True:
+            batch, done = await self._collect_batch()
+            if batch:
+                await self._flush(batch)
+            if done:
+                return
+
+    async def _flush(self, batch):
+        records = [record for record, _ in batch]
+        try:
+            outcomes = [result['outcome'] for result in await self.writer.insert_articles(records)]
+        except Exception as e:
+            logger.error(f"批量保存 {len(records)} 篇文章到数据库时出错: {str(e)}")
+            outcomes = [OUTCOME_FAILED] * len(records)
+
+        for (_, future), outcome in zip(batch, outcomes):
+            self.stats[outcome] += 1
+            future.set_result(outcome)
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 本地 KV 键索引文件
+DEFAULT_KV_INDEX_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.kv_keys.json'
+# 距上次完整同步超过该时间（秒）才重新列出远端命名空间
+DEFAULT_SYNC_INTERVAL = 24 * 3600
+# 每页列出的键数量，Cloudflare 上限为 1000
+DEFAULT_LIST_LIMIT = 1000
+
+
+class KVKeyIndex:
+    """
+    Cloudflare KV 键和元数据的本地镜像：通过 cursor 分页同步远端命名空间，
+    本进程写入的键直接加入索引，查询时不再请求远端
+
+    站点名称取自元数据中的 Name 字段，早期写入的键没有该字段，无法按站点查到
+    """
+
+    def __init__(self, path=DEFAULT_KV_INDEX_FILE, sync_interval=DEFAULT_SYNC_INTERVAL):
+        self.path = Path(path)
+        self.sync_interval = sync_interval
+        self.keys: Dict[str, Dict] = {}
+        self.synced_at = 0
+        # 未完成的同步：下一页的 cursor 和已经列出的键，中断后从这里继续
+        self._sync_state: Optional[Dict] = None
+        self._sites: Dict[str, List[str]] = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding='utf-8'))
+                self.keys = data.get('keys', {})
+                self.synced_at = data.get('synced_at', 0)
+                self._sync_state = data.get('sync_state')
+            except ValueError:
+                logger.warning(f"KV 索引文件 {self.path} 损坏，将重新同步")
+        self._rebuild_sites()
+
+    def _rebuild_sites(self):
+        self._sites = {}
+        for key, metadata in self.keys.items():
+            self._index_site(key, metadata)
+
+    def _index_site(self, key, metadata):
+        name = metadata.get('Name') if isinstance(metadata, dict) else None
+        if name:
+            keys = self._sites.setdefault(name, [])
+            if key not in keys:
+                keys.append(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def has_site(self, name) -> bool:
+        """站点截图是否已经写入 KV"""
+        return name in self._sites
+
+    def keys_for_site(self, name) -> List[str]:
+        return list(self._sites.get(name, []))
+
+    def add(self, key, metadata=None):
+        """记录本进程成功写入的键"""
+        metadata = metadata or {}
+        self.keys[key] = metadata
+        self._index_site(key, metadata)
+        if self._sync_state is not None:
+            self._sync_state['keys'][key] = metadata
+
+    def is_stale(self) -> bool:
+        return self._sync_state is not None or time.time() - self.synced_at >= self.sync_interval
+
+    async def sync(self, list_page: Callable[..., Awaitable[Dict]], force=False) -> bool:
+        """
+        按 cursor 逐页列出远端命名空间，全部列完后替换本地索引（远端已删除的键随之移除）
+
+        Args:
+            list_page: 形如 AsyncImageUploader.list_kv_keys(cursor, limit) 的协程函数，
+                返回 {'success': True, 'keys': [...], 'cursor': 下一页 cursor 或 None}
+            force: 为 True 时忽略同步间隔
+
+        Returns:
+            bool: 是否完成了同步；未到同步时间或中途失败时返回 False，失败时保留进度
+        """
+        if not force and not self.is_stale():
+            logger.info(f"KV 索引 {len(self.keys)} 个键，距上次同步未超过 {self.sync_interval} 秒，跳过")
+            return False
+        if self._sync_state is None:
+            self._sync_state = {'cursor': None, 'keys': {}}
+        elif self._sync_state.get('cursor'):
+            logger.info(f"从上次中断处继续同步 KV 索引，已列出 {len(self._sync_state['keys'])} 个键")
+
+        pages = 0
+        # 上次保存的 cursor 可能已经过期，用它请求失败时丢弃进度从头同步，避免之后每次都卡在同一个 cursor
+        resumed = bool(self._sync_state.get('cursor'))
+        while True:
+            page = await list_page(cursor=self._sync_state.get('cursor'), limit=DEFAULT_LIST_LIMIT)
+            if 'success' not in page and resumed:
+                logger.warning(f"从保存的 cursor 继续同步失败，从头重新同步: {page.get('error')}")
+                self._sync_state = {'cursor': None, 'keys': {}}
+                resumed = False
+                continue
+            resumed = False
+            if 'success' not in page:
+                logger.warning(f"同步 KV 索引失败，已列出 {len(self._sync_state['keys'])} 个键: {page.get('error')}")
+                self.save()
+                return False
+            pages += 1
+            for item in page['keys']:
+                self._sync_state['keys'][item['name']] = item.get('metadata') or {}
+            self._sync_state['cursor'] = page.get('cursor')
+            if not self._sync_state['cursor']:
+                break
+            # 每页都保存进度，进程中断后下次从该 cursor 继续
+            self.save()
+
+        self.keys = self._sync_state['keys']
+        self._sync_state = None
+        self.synced_at = int(time.time())
+        self._rebuild_sites()
+        self.save()
+        logger.info(f"KV 索引同步完成: {pages} 页, {len(self.keys)} 个键, {len(self._sites)} 个站点")
+        return True
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        data = {'synced_at': self.synced_at, 'keys': self.keys}
+        if self._sync_state is not None:
+            data['sync_state'] = self._sync_state
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, self.path)
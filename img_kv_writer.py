@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from img_telegram_scheduler import retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Cloudflare KV 批量写入接口单次最多 10000 个键值对、请求体不超过 100MB
+MAX_KV_BULK_ITEMS = 10000
+MAX_KV_BULK_BYTES = 90 * 1024 * 1024
+# 攒够多少条立即写入
+DEFAULT_KV_BATCH_SIZE = 500
+# 第一条记录进入缓冲区后最多等待多久写入（秒）
+DEFAULT_KV_FLUSH_INTERVAL = 10.0
+# 单批最大重试次数
+DEFAULT_KV_MAX_RETRIES = 3
+
+
+class KVBulkWriter:
+    """
+    Cloudflare KV 批量写入器：收集 key/value/metadata，按条数、字节数或等待时间触发，
+    通过 PUT /bulk 一次写入一批，并把每条记录的成功或失败分别返回给提交方
+
+    用法:
+        writer = KVBulkWriter(session, kv_url, api_token)
+        result = await writer.put(key, value, metadata)   # 等待所在批次写入完成
+        future = writer.submit(key, value, metadata)      # 不等待，稍后从 future 取结果
+        await writer.close()                              # 写入缓冲区中剩余的记录
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, kv_url: str, api_token: str,
+                 batch_size: int = DEFAULT_KV_BATCH_SIZE, flush_interval: float = DEFAULT_KV_FLUSH_INTERVAL,
+                 max_retries: int = DEFAULT_KV_MAX_RETRIES):
+        """
+        Args:
+            session: 共享的 aiohttp 会话
+            kv_url: .../accounts/<account>/storage/kv/namespaces/<namespace>
+            api_token: Cloudflare API Token
+            batch_size: 攒够多少条立即写入，不超过 MAX_KV_BULK_ITEMS
+            flush_interval: 第一条记录进入缓冲区后最多等待多久写入（秒）
+            max_retries: 单批最大重试次数
+        """
+        self.session = session
+        self.bulk_url = f'{kv_url}/bulk'
+        self.api_token = api_token
+        self.batch_size = max(1, min(batch_size, MAX_KV_BULK_ITEMS))
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        # (记录, 序列化后的字节数, future)
+        self._pending: List[Tuple[Dict, int, asyncio.Future]] = []
+        self._pending_bytes = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._flushing = set()
+        self.request_count = 0
+
+    def submit(self, key: str, value: str, metadata: Optional[Dict] = None) -> asyncio.Future:
+        """
+        加入缓冲区并立即返回 future，写入完成后结果为 {'success': True} 或 {'error': ...}
+        """
+        item = {'key': key, 'value': value}
+        if metadata is not None:
+            item['metadata'] = metadata
+        size = len(json.dumps(item, ensure_ascii=False).encode('utf-8'))
+        if self._pending and self._pending_bytes + size > MAX_KV_BULK_BYTES:
+            self._start_flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, size, future))
+        self._pending_bytes += size
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return future
+
+    async def put(self, key: str, value: str, metadata: Optional[Dict] = None) -> Dict:
+        """加入缓冲区并等待所在批次写入完成"""
+        return await self.submit(key, value, metadata)
+
+    async def flush(self):
+        """立即写入缓冲区中的记录，并等待所有进行中的批次完成"""
+        self._start_flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing)
+
+    async def close(self):
+        await self.flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        task = asyncio.create_task(self._write_batch(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _write_batch(self, batch):
+        try:
+            failed_keys = await self._send_with_retry([item for item, _, _ in batch])
+        except Exception as e:
+            logger.error(f"批量写入 Cloudflare KV 异常: {str(e)}", exc_info=True)
+            failed_keys = None
+
+        for item, _, future in batch:
+            if future.done():
+                continue
+            if failed_keys is None:
+                future.set_result({'error': '写入 Cloudflare KV 失败'})
+            elif item['key'] in failed_keys:
+                future.set_result({'error': f"写入 Cloudflare KV 失败: {item['key']}"})
+            else:
+                future.set_result({'success': True})
+
+    async def _send_with_retry(self, items) -> Optional[set]:
+        """写入一批记录，返回写入失败的 key 集合，整批失败时返回 None"""
+        headers = {'Authorization': f'Bearer {self.api_token}'}
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                self.request_count += 1
+                async with self.session.put(self.bulk_url, json=items, headers=headers) as response:
+                    payload = await response.json(content_type=None)
+                    if response.status == 200 and payload.get('success'):
+                        result = payload.get('result') or {}
+                        failed_keys = set(result.get('unsuccessful_keys') or [])
+                        logger.info(f"批量写入 Cloudflare KV: 成功 {len(items) - len(failed_keys)} 条, "
+                                    f"失败 {len(failed_keys)} 条")
+                        return failed_keys
+                    if response.status == 429:
+                        retry_after = float(response.headers.get('Retry-After', 0)) or None
+                    elif 400 <= response.status < 500:
+                        logger.error(f"Cloudflare KV 拒绝了 {len(items)} 条记录: {payload.get('errors')}")
+                        return None
+                    logger.warning(f"Cloudflare KV 返回 {response.status}: {payload.get('errors')}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"请求 Cloudflare KV 失败: {str(e) or type(e).__name__}")
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(retry_delay(attempt, retry_after))
+        logger.error(f"重试 {self.max_retries} 次后仍然无法写入 {len(items)} 条记录")
+        return None
@@ -0,0 +1,72 @@
+import datetime
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image
+
+# 截图感知哈希索引文件，按站点名称记录上一次上传的截图哈希
+DEFAULT_PHASH_INDEX_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.screenshot_phash.json'
+# 汉明距离不超过该值视为近似重复
+DEFAULT_MAX_DISTANCE = 5
+# dHash 边长，哈希位数为 HASH_SIZE * HASH_SIZE
+HASH_SIZE = 8
+
+
+def dhash(image_bytes: bytes, hash_size: int = HASH_SIZE) -> int:
+    """计算图片的差值哈希（dHash），对缩放、压缩质量和细小变化不敏感"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(left: int, right: int) -> int:
+    return bin(left ^ right).count('1')
+
+
+class ScreenshotHashIndex:
+    """本地截图哈希索引，用于在上传前判断截图与上一次是否近似重复"""
+
+    def __init__(self, path=DEFAULT_PHASH_INDEX_FILE, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.path = Path(path)
+        self.max_distance = max_distance
+        self.entries = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+            except ValueError:
+                self.entries = {}
+
+    def find_duplicate(self, name: str, image_hash: int) -> Optional[Dict]:
+        """
+        与同名站点上一次的截图比较
+
+        Returns:
+            近似重复时返回上一次的记录（含 src 和 distance），否则返回 None
+        """
+        entry = self.entries.get(name)
+        if not entry:
+            return None
+        distance = hamming_distance(int(entry['hash'], 16), image_hash)
+        if distance > self.max_distance:
+            return None
+        return dict(entry, distance=distance)
+
+    def update(self, name: str, image_hash: int, src: str):
+        self.entries[name] = {
+            'hash': f'{image_hash:016x}',
+            'src': src,
+            'updated_at': datetime.datetime.now().isoformat(),
+        }
+
+    def save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.entries, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
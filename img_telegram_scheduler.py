@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Telegram 对同一个群组大约每分钟 20 条消息，默认按此限速
+DEFAULT_RATE_PER_SECOND = 20 / 60
+# 令牌桶容量，允许的瞬时突发请求数
+DEFAULT_BURST = 3
+# sendMediaGroup 单次最多 10 张图片
+MAX_MEDIA_GROUP_SIZE = 10
+# 凑批时最多等待的时间（秒）
+DEFAULT_BATCH_WAIT = 2.0
+# 单批最大重试次数
+DEFAULT_MAX_RETRIES = 5
+# 指数退避的基础时间和上限（秒）
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    计算重试等待时间：有 retry_after 时在其基础上加少量抖动，否则使用带抖动的指数退避
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def get_photo_file_id(message: Dict) -> Optional[str]:
+    """取消息中尺寸最大的图片 file_id"""
+    photos = message.get('photo') if message else None
+    if not photos:
+        return None
+    return max(photos, key=lambda x: x.get('file_size', 0))['file_id']
+
+
+class TokenBucket:
+    """令牌桶限速器，所有 Telegram 发送共享"""
+
+    def __init__(self, rate: float = DEFAULT_RATE_PER_SECOND, capacity: int = DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """收到 429 后清空令牌，让后续请求至少等待 seconds 秒"""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class TelegramSendScheduler:
+    """
+    Telegram 图片发送调度器：把并发提交的图片凑成最多 10 张一组通过 sendMediaGroup 发送，
+    按令牌桶限速，遇到 429 按 parameters.retry_after 等待，其他失败按带抖动的指数退避重试，
+    并把返回的 file_id 按顺序对应回每张图片
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, api_base_url: str, chat_id: str,
+                 rate_per_second: float = DEFAULT_RATE_PER_SECOND, burst: int = DEFAULT_BURST,
+                 batch_size: int = MAX_MEDIA_GROUP_SIZE, batch_wait: float = DEFAULT_BATCH_WAIT,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        """
+        Args:
+            session: 共享的 aiohttp 会话
+            api_base_url: https://api.telegram.org/bot<token>
+            chat_id: 目标会话 ID
+            rate_per_second: 每秒允许的请求数
+            burst: 允许的瞬时突发请求数
+            batch_size: 每组图片数量，1 表示逐张 sendPhoto
+            batch_wait: 凑批时最多等待的时间（秒）
+            max_retries: 单批最大重试次数
+        """
+        self.session = session
+        self.api_base_url = api_base_url
+        self.chat_id = chat_id
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.batch_size = max(1, min(batch_size, MAX_MEDIA_GROUP_SIZE))
+        self.batch_wait = batch_wait
+        self.max_retries = max_retries
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def send_photo(self, name: str, image_bytes: bytes, file_name: str) -> Dict:
+        """
+        提交一张图片，发送完成后返回 {'file_id': ...}，失败时返回 {'error': ...}
+        """
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((name, image_bytes, file_name, future))
+        return await future
+
+    async def close(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _collect_batch(self) -> List[Tuple]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            file_ids, rejected = await self._send_batch(batch)
+            if file_ids is None and rejected and len(batch) > 1:
+                # Telegram 明确拒绝整组（4xx，未发送任何图片）时逐张重发，避免一张坏图拖累同组的其他图片；
+                # 其他失败时图片可能已经发出，不再重发
+                file_ids = []
+                for item in batch:
+                    single, _ = await self._send_batch([item])
+                    file_ids.append(single[0] if single else None)
+            for index, (name, _, _, future) in enumerate(batch):
+                if future.done():
+                    continue
+                file_id = file_ids[index] if file_ids and index < len(file_ids) else None
+                if file_id:
+                    future.set_result({'file_id': file_id})
+                else:
+                    future.set_result({'error': f'上传到 Telegram 失败: {name}'})
+
+    async def _send_batch(self, batch) -> Tuple[Optional[List[Optional[str]]], bool]:
+        try:
+            return await self._send_with_retry(batch)
+        except Exception as e:
+            logger.error(f"发送图片到 Telegram 异常: {str(e)}", exc_info=True)
+            return None, False
+
+    def _build_request(self, batch) -> Tuple[str, aiohttp.FormData]:
+        form = aiohttp.FormData()
+        form.add_field('chat_id', str(self.chat_id))
+        if len(batch) == 1:
+            _, image_bytes, file_name, _ = batch[0]
+            form.add_field('photo', image_bytes, filename=file_name)
+            return f'{self.api_base_url}/sendPhoto', form
+
+        media = []
+        for index, (_, image_bytes, file_name, _) in enumerate(batch):
+            attach_name = f'photo{index}'
+            media.append({'type': 'photo', 'media': f'attach://{attach_name}'})
+            form.add_field(attach_name, image_bytes, filename=file_name)
+        form.add_field('media', json.dumps(media))
+        return f'{self.api_base_url}/sendMediaGroup', form
+
+    async def _send_with_retry(self, batch) -> Tuple[Optional[List[Optional[str]]], bool]:
+        """
+        发送一批图片，只在网络错误、超时、5xx 和 429 时重试，其余响应无论能否解析都不再重发，避免重复发送
+
+        Returns:
+            tuple: (与 batch 顺序一致的 file_id 列表，失败时为 None；Telegram 是否以 4xx 明确拒绝了这批图片)
+        """
+        names = [item[0] for item in batch]
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            url, form = self._build_request(batch)
+            retry_after = None
+            try:
+                async with self.session.post(url, data=form) as response:
+                    status = response.status
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"请求 Telegram 失败: {str(e) or type(e).__name__}")
+                status, body = None, None
+
+            if status is not None:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    payload = None
+                if not isinstance(payload, dict):
+                    payload = {}
+                if status == 429:
+                    retry_after = (payload.get('parameters') or {}).get('retry_after')
+                    if retry_after is not None:
+                        self.bucket.pause(retry_after)
+                    logger.warning(f"Telegram 限流，retry_after={retry_after}")
+                elif status < 500:
+                    if status == 200 and payload.get('ok'):
+                        result = payload['result']
+                        messages = result if isinstance(result, list) else [result]
+                        return [get_photo_file_id(message) for message in messages], False
+                    # 请求已被 Telegram 处理，重发可能产生重复图片；4xx 说明这批图片被拒绝，没有发出
+                    logger.error(f"Telegram 返回 {status}，不再重发 {names}: "
+                                 f"{payload.get('description') or body[:200]!r}")
+                    return None, 400 <= status < 500
+                else:
+                    logger.warning(f"Telegram 返回 {status}: {payload.get('description')}")
+
+            if attempt < self.max_retries:
+                delay = retry_delay(attempt, retry_after)
+                logger.info(f"{len(batch)} 张图片第 {attempt + 1} 次重试，等待 {delay:.1f} 秒")
+                await asyncio.sleep(delay)
+        logger.error(f"重试 {self.max_retries} 次后仍然失败: {names}")
+        return None, False
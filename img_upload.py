@@ -1,3 +1,5 @@
+import asyncio
+import aiohttp
 import requests
 import os
 from dotenv import load_dotenv
@@ -7,6 +9,12 @@ import datetime
 from pathlib import Path
 from typing import Dict, Optional
 
+from img_kv_index import KVKeyIndex
+from img_kv_writer import DEFAULT_KV_BATCH_SIZE, DEFAULT_KV_FLUSH_INTERVAL, KVBulkWriter
+from img_upload_ledger import UploadLedger, image_sha256
+from img_telegram_scheduler import (DEFAULT_BATCH_WAIT, DEFAULT_RATE_PER_SECOND, MAX_MEDIA_GROUP_SIZE,
+                                    TelegramSendScheduler, retry_delay)
+
 # 在文件顶部一次性加载所有环境变量
 load_dotenv()
 TG_Bot_Token = os.getenv('TG_BOT_TOKEN')
@@ -14,70 +22,157 @@ TG_Chat_ID = os.getenv('TG_CHAT_ID')
 CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
 CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
 CLOUDFLARE_NAMESPACE_ID = os.getenv('CLOUDFLARE_NAMESPACE_ID')
+# API 地址，可通过环境变量指向代理或本地测试服务
+TG_API_BASE = os.getenv('TG_API_BASE', 'https://api.telegram.org')
+CLOUDFLARE_API_BASE = os.getenv('CLOUDFLARE_API_BASE', 'https://api.cloudflare.com/client/v4')
+
+# 截图格式对应的文件扩展名
+IMAGE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+# 异步上传器逐条写入 KV 时同时进行的请求数，Telegram 上传由调度器限速，不受此限制
+DEFAULT_UPLOAD_CONCURRENCY = 4
+# 请求超时（秒）
+REQUEST_TIMEOUT = 60
+# 同步上传遇到 429 或网络错误时的最大重试次数
+MAX_RETRIES = 3
+
+# 进程内共享的连接池，复用到 Telegram 和 Cloudflare 的 keep-alive 连接
+_session = requests.Session()
+
+
+def _telegram_api_url(method: str) -> str:
+    return f'{TG_API_BASE}/bot{TG_Bot_Token}/{method}'
+
+
+def _cloudflare_kv_url() -> str:
+    return (
+        f'{CLOUDFLARE_API_BASE}/accounts/'
+        f'{CLOUDFLARE_ACCOUNT_ID}/storage/kv/namespaces/'
+        f'{CLOUDFLARE_NAMESPACE_ID}'
+    )
+
+
+def _kv_metadata(name: Optional[str] = None) -> Dict:
+    metadata = {
+        "CurrentDateTime": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "Label": "None",
+        "ListType": "None",
+        "TimeStamp": int(time.time() * 1000),
+        "liked": True
+    }
+    # 站点名称，本地 KV 索引据此判断站点是否已经写入
+    if name:
+        metadata["Name"] = name
+    return metadata
+
+
+def _parse_kv_keys(response: Dict) -> Dict:
+    """把 list keys 的一页响应转换为 {'success', 'keys', 'cursor'}，cursor 为空表示已经是最后一页"""
+    kv_keys = [
+        {'name': item['name'], 'metadata': item.get('metadata', 'No metadata')}
+        for item in response.get("result", [])
+    ]
+    cursor = (response.get('result_info') or {}).get('cursor') or None
+    return {'success': True, 'keys': kv_keys, 'cursor': cursor}
+
+
+def _get_file_id(response: Dict) -> Optional[str]:
+    if not response.get('ok') or not response.get('result'):
+        return None
+    if 'photo' in response['result']:
+        return max(response['result']['photo'], key=lambda x: x['file_size'])['file_id']
+    return None
+
+
+def _handle_error(message: str) -> Dict:
+    return {'error': message, 'timestamp': datetime.datetime.now().isoformat()}
+
 
 class ImageUploader:
-    def __init__(self, output_path: str, img_name: str):
-        self.file_path = Path(output_path) / f"{img_name}.png"
+    def __init__(self, output_path: str, img_name: str, image_bytes: Optional[bytes] = None,
+                 image_format: str = 'png', ledger: Optional[UploadLedger] = None):
+        """
+        Args:
+            output_path: 截图所在目录，传入 image_bytes 时不会读取
+            img_name: 图片名称（站点名称）
+            image_bytes: 内存中的图片内容，传入时直接上传，不经过磁盘
+            image_format: 图片格式 png/jpeg/webp
+            ledger: 上传记录，同一站点内容相同的图片复用已有的 file_id
+        """
+        extension = IMAGE_EXTENSIONS.get(image_format, image_format)
+        self.file_path = Path(output_path) / f"{img_name}.{extension}"
         self.img_name = img_name
-        self.telegram_api_url = f'https://api.telegram.org/bot{TG_Bot_Token}/sendPhoto'
-        self.cloudflare_kv_url = (
-            f'https://api.cloudflare.com/client/v4/accounts/'
-            f'{CLOUDFLARE_ACCOUNT_ID}/storage/kv/namespaces/'
-            f'{CLOUDFLARE_NAMESPACE_ID}'
-        )
+        self.image_bytes = image_bytes
+        self.ledger = ledger
+        self.telegram_api_url = _telegram_api_url('sendPhoto')
+        self.cloudflare_kv_url = _cloudflare_kv_url()
 
     def _handle_error(self, message: str) -> Dict:
         """统一错误处理"""
-        return {'error': message, 'timestamp': datetime.datetime.now().isoformat()}
+        return _handle_error(message)
 
     def _make_request(self, url: str, method: str = 'POST', **kwargs) -> Optional[Dict]:
-        """统一请求处理"""
-        try:
-            response = requests.request(method, url, **kwargs)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return None
+        """统一请求处理，429 按 retry_after 等待、网络错误和 5xx 退避后重试，其余响应不重试"""
+        for attempt in range(MAX_RETRIES + 1):
+            retry_after = None
+            try:
+                response = _session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            except requests.exceptions.RequestException:
+                response = None
+            if response is not None and response.status_code == 429:
+                try:
+                    retry_after = response.json().get('parameters', {}).get('retry_after')
+                except ValueError:
+                    pass
+            elif response is not None and response.status_code < 500:
+                # 请求已被服务端处理，无论结果如何都不再重发，避免重复上传
+                if not response.ok:
+                    return None
+                try:
+                    return response.json()
+                except ValueError:
+                    return None
+            if attempt < MAX_RETRIES:
+                # 文件对象需要回到开头才能重新发送
+                for file in (kwargs.get('files') or {}).values():
+                    if hasattr(file, 'seek'):
+                        file.seek(0)
+                time.sleep(retry_delay(attempt, retry_after))
+        return None
 
     def upload_file(self) -> Dict:
         """上传文件到Telegram"""
+        if self.image_bytes is not None:
+            return self._send_photo((self.file_path.name, self.image_bytes))
         if not self.file_path.exists():
             return self._handle_error(f'文件不存在: {self.file_path}')
         with open(self.file_path, 'rb') as upload_file:
-            file_extension = self.file_path.suffix.lower()
-            response = self._make_request(
-                self.telegram_api_url,
-                files={'photo': upload_file},
-                data={'chat_id': TG_Chat_ID}
-            )
+            return self._send_photo(upload_file)
 
-            if not response:
-                return self._handle_error('上传到 Telegram 失败')
+    def _send_photo(self, photo) -> Dict:
+        file_extension = self.file_path.suffix.lower()
+        response = self._make_request(
+            self.telegram_api_url,
+            files={'photo': photo},
+            data={'chat_id': TG_Chat_ID}
+        )
+
+        if not response:
+            return self._handle_error('上传到 Telegram 失败')
 
-            file_id = self.get_file_id(response)
-            if not file_id:
-                return self._handle_error('获取文件 ID 失败')
+        file_id = self.get_file_id(response)
+        if not file_id:
+            return self._handle_error('获取文件 ID 失败')
 
-            return {'src': f'{file_id}{file_extension}'}
+        return {'src': f'{file_id}{file_extension}'}
 
     def get_file_id(self, response):
-        if not response.get('ok') or not response.get('result'):
-            return None
-        if 'photo' in response['result']:
-            return max(response['result']['photo'], key=lambda x: x['file_size'])['file_id']
-        return None
+        return _get_file_id(response)
 
     def write_to_cloudflare_kv(self, key: str, value: str) -> Dict:
         """写入Cloudflare KV存储"""
         api_url = f'{self.cloudflare_kv_url}/values/{key}'
-        metadata = {
-            "CurrentDateTime": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "Label": "None",
-            "ListType": "None",
-            "TimeStamp": int(time.time() * 1000),
-            "liked": True
-        }
-        
+        metadata = _kv_metadata(value)
+
         response = self._make_request(
             api_url,
             method='PUT',
@@ -91,33 +186,259 @@ class ImageUploader:
         return {'success': True} if response else self._handle_error('写入 Cloudflare KV 失败')
 
     def upload_and_write_kv(self, write_kv: bool = False) -> Dict:
-        """上传文件并可选写入KV存储"""
-        upload_result = self.upload_file()
-        if "error" in upload_result:
-            return upload_result
-            
-        if write_kv:
+        """上传文件并可选写入KV存储，有上传记录时内容相同的图片不再重复上传和写入"""
+        sha256 = None
+        entry = None
+        if self.ledger:
+            if self.image_bytes is None and self.file_path.exists():
+                self.image_bytes = self.file_path.read_bytes()
+            if self.image_bytes is not None:
+                sha256 = image_sha256(self.image_bytes)
+                entry = self.ledger.get(sha256, self.img_name)
+
+        if entry:
+            upload_result = {'src': entry['src'], 'reused': True, 'kv_written': entry['kv_key'] == entry['src']}
+        else:
+            upload_result = self.upload_file()
+            if "error" in upload_result:
+                return upload_result
+            if sha256:
+                self.ledger.record_upload(sha256, self.img_name, upload_result['src'])
+
+        if write_kv and not upload_result.get('kv_written'):
             key = upload_result["src"]
             kv_result = self.write_to_cloudflare_kv(key, self.img_name)
             if "error" in kv_result:
                 return kv_result
-                
+            if self.ledger:
+                self.ledger.mark_kv_written(key)
+
         return upload_result
 
-    def read_kv_keys(self) -> Dict:
-        """读取Cloudflare KV存储的keys"""
-        api_url = f'{self.cloudflare_kv_url}/keys'
+    def list_kv_keys(self, cursor: Optional[str] = None, limit: int = 1000) -> Dict:
+        """按 cursor 读取一页 Cloudflare KV 存储的keys"""
+        params = {'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
         response = self._make_request(
-            api_url,
+            f'{self.cloudflare_kv_url}/keys',
             method='GET',
-            headers={'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}'}
+            headers={'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}'},
+            params=params
         )
-        
         if not response:
             return self._handle_error('读取 Cloudflare KV 失败')
-            
-        kv_keys = [
-            {'name': item['name'], 'metadata': item.get('metadata', 'No metadata')}
-            for item in response.get("result", [])
-        ]
-        return {'success': True, 'keys': kv_keys}
+        return _parse_kv_keys(response)
+
+    def read_kv_keys(self) -> Dict:
+        """读取Cloudflare KV存储的全部keys，按 cursor 翻页直到最后一页"""
+        kv_keys = []
+        cursor = None
+        while True:
+            page = self.list_kv_keys(cursor)
+            if "error" in page:
+                return page
+            kv_keys.extend(page['keys'])
+            cursor = page['cursor']
+            if not cursor:
+                return {'success': True, 'keys': kv_keys}
+
+
+class AsyncImageUploader:
+    """
+    基于 aiohttp 的上传器，整个运行期间共享一个连接池，保持到 api.telegram.org 和
+    api.cloudflare.com 的 keep-alive 连接；Telegram 发送由 TelegramSendScheduler 限速和合并，
+    KV 写入默认由 KVBulkWriter 攒批后通过批量接口写入
+
+    用法:
+        async with AsyncImageUploader() as uploader:
+            result = await uploader.upload_and_write_kv(img_name, image_bytes, write_kv=True)
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_UPLOAD_CONCURRENCY,
+                 telegram_rate: float = DEFAULT_RATE_PER_SECOND, media_group_size: int = MAX_MEDIA_GROUP_SIZE,
+                 kv_bulk: bool = True, kv_batch_size: int = DEFAULT_KV_BATCH_SIZE,
+                 kv_flush_interval: float = DEFAULT_KV_FLUSH_INTERVAL, kv_index: Optional[KVKeyIndex] = None,
+                 ledger: Optional[UploadLedger] = None, telegram_batch_wait: float = DEFAULT_BATCH_WAIT):
+        """
+        图片统一交给一个 TelegramSendScheduler 合并发送，吞吐由 telegram_rate 和 media_group_size 决定，
+        与 max_concurrency 无关；并发调用 upload_and_write_kv 的作用是让调度器能凑满一组
+
+        Args:
+            max_concurrency: 逐条写入 KV 时同时进行的数量，也是每个主机的连接数上限
+            telegram_rate: Telegram 每秒允许的请求数
+            media_group_size: 每次 sendMediaGroup 合并的图片数，1 表示逐张 sendPhoto
+            telegram_batch_wait: 凑满一组前最多等待的时间（秒）
+            kv_bulk: 是否通过批量接口写入 KV，为 False 时每条记录单独 PUT
+            kv_batch_size: 批量写入时攒够多少条立即写入
+            kv_flush_interval: 批量写入时第一条记录最多等待多久写入（秒）
+            kv_index: 本地 KV 键索引，写入成功的键会同步加入
+            ledger: 上传记录，同一站点内容相同的图片复用已有的 file_id
+        """
+        self.max_concurrency = max_concurrency
+        self.telegram_rate = telegram_rate
+        self.media_group_size = media_group_size
+        self.telegram_batch_wait = telegram_batch_wait
+        self.kv_bulk = kv_bulk
+        self.kv_batch_size = kv_batch_size
+        self.kv_flush_interval = kv_flush_interval
+        self.kv_index = kv_index
+        self.ledger = ledger
+        self.cloudflare_kv_url = _cloudflare_kv_url()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.scheduler: Optional[TelegramSendScheduler] = None
+        self.kv_writer: Optional[KVBulkWriter] = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        self.scheduler = TelegramSendScheduler(
+            self._session, f'{TG_API_BASE}/bot{TG_Bot_Token}', TG_Chat_ID,
+            rate_per_second=self.telegram_rate, batch_size=self.media_group_size, batch_wait=self.telegram_batch_wait)
+        if self.kv_bulk:
+            self.kv_writer = KVBulkWriter(self._session, self.cloudflare_kv_url, CLOUDFLARE_API_TOKEN,
+                                          batch_size=self.kv_batch_size, flush_interval=self.kv_flush_interval)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        # 先写完缓冲区中的 KV 记录再关闭连接池
+        if self.kv_writer:
+            await self.kv_writer.close()
+            self.kv_writer = None
+        if self.scheduler:
+            await self.scheduler.close()
+            self.scheduler = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _make_request(self, url: str, method: str = 'POST', **kwargs) -> Optional[Dict]:
+        """统一请求处理"""
+        try:
+            async with self._session.request(method, url, **kwargs) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def upload_file(self, img_name: str, image_bytes: Optional[bytes] = None, output_path: str = '.',
+                          image_format: str = 'png') -> Dict:
+        """上传图片到 Telegram，未传入 image_bytes 时从 output_path 读取，由调度器限速并合并发送"""
+        extension = IMAGE_EXTENSIONS.get(image_format, image_format)
+        file_name = f'{img_name}.{extension}'
+        if image_bytes is None:
+            file_path = Path(output_path) / file_name
+            if not file_path.exists():
+                return _handle_error(f'文件不存在: {file_path}')
+            image_bytes = await asyncio.to_thread(file_path.read_bytes)
+
+        send_result = await self.scheduler.send_photo(img_name, image_bytes, file_name)
+        if 'error' in send_result:
+            return _handle_error(send_result['error'])
+        return {'src': f"{send_result['file_id']}.{extension}"}
+
+    def submit_kv_write(self, key: str, value: str) -> asyncio.Future:
+        """
+        提交一条 KV 记录后立即返回 future，不等待写入完成，结果与 write_to_cloudflare_kv 相同；
+        批量模式下由 KVBulkWriter 攒批写入，否则后台逐条写入
+        """
+        metadata = _kv_metadata(value)
+        if self.kv_writer:
+            future = self.kv_writer.submit(key, value, metadata)
+        else:
+            future = asyncio.ensure_future(self._put_kv_value(key, value, metadata))
+        future.add_done_callback(lambda done: self._on_kv_written(key, metadata, done))
+        return future
+
+    def _on_kv_written(self, key: str, metadata: Dict, future: asyncio.Future):
+        if future.cancelled() or 'success' not in future.result():
+            return
+        if self.kv_index is not None:
+            self.kv_index.add(key, metadata)
+        if self.ledger:
+            self.ledger.mark_kv_written(key)
+
+    async def write_to_cloudflare_kv(self, key: str, value: str) -> Dict:
+        """写入Cloudflare KV存储，批量模式下等待所在批次写入完成"""
+        result = await self.submit_kv_write(key, value)
+        return result if 'success' in result else _handle_error(result['error'])
+
+    async def _put_kv_value(self, key: str, value: str, metadata: Dict) -> Dict:
+        # 带元数据写入要求 multipart，只有字符串字段时 FormData 默认按 urlencoded 发送
+        form = aiohttp.FormData(default_to_multipart=True)
+        form.add_field('value', value)
+        form.add_field('metadata', json.dumps(metadata))
+        async with self._semaphore:
+            response = await self._make_request(
+                f'{self.cloudflare_kv_url}/values/{key}',
+                method='PUT',
+                headers={'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}'},
+                data=form
+            )
+        return {'success': True} if response else _handle_error('写入 Cloudflare KV 失败')
+
+    async def upload_and_write_kv(self, img_name: str, image_bytes: Optional[bytes] = None, output_path: str = '.',
+                                  image_format: str = 'png', write_kv: bool = False) -> Dict:
+        """
+        上传文件并可选写入KV存储，返回结构与 ImageUploader.upload_and_write_kv 一致；
+        有上传记录时内容相同的图片直接返回 {'src', 'reused': True, 'kv_written': 是否已写入 KV}
+        """
+        sha256 = None
+        entry = None
+        if self.ledger:
+            if image_bytes is None:
+                file_path = Path(output_path) / f'{img_name}.{IMAGE_EXTENSIONS.get(image_format, image_format)}'
+                if file_path.exists():
+                    image_bytes = await asyncio.to_thread(file_path.read_bytes)
+            if image_bytes is not None:
+                sha256 = image_sha256(image_bytes)
+                entry = self.ledger.get(sha256, img_name)
+
+        if entry:
+            upload_result = {'src': entry['src'], 'reused': True, 'kv_written': entry['kv_key'] == entry['src']}
+        else:
+            upload_result = await self.upload_file(img_name, image_bytes, output_path, image_format)
+            if "error" in upload_result:
+                return upload_result
+            if sha256:
+                self.ledger.record_upload(sha256, img_name, upload_result['src'])
+
+        if write_kv and not upload_result.get('kv_written'):
+            kv_result = await self.write_to_cloudflare_kv(upload_result["src"], img_name)
+            if "error" in kv_result:
+                return kv_result
+
+        return upload_result
+
+    async def list_kv_keys(self, cursor: Optional[str] = None, limit: int = 1000) -> Dict:
+        """按 cursor 读取一页 Cloudflare KV 存储的keys，可直接传给 KVKeyIndex.sync"""
+        params = {'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        response = await self._make_request(
+            f'{self.cloudflare_kv_url}/keys',
+            method='GET',
+            headers={'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}'},
+            params=params
+        )
+        if not response:
+            return _handle_error('读取 Cloudflare KV 失败')
+        return _parse_kv_keys(response)
+
+    async def read_kv_keys(self) -> Dict:
+        """读取Cloudflare KV存储的全部keys，按 cursor 翻页直到最后一页"""
+        kv_keys = []
+        cursor = None
+        while True:
+            page = await self.list_kv_keys(cursor)
+            if "error" in page:
+                return page
+            kv_keys.extend(page['keys'])
+            cursor = page['cursor']
+            if not cursor:
+                return {'success': True, 'keys': kv_keys}
@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 上传记录数据库，按站点名称和图片内容的 sha256 记录 Telegram file_id 和 KV 键
+DEFAULT_LEDGER_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.upload_ledger.sqlite3'
+
+# KV 记录以 src 为键、站点名称为值，不同站点即使截图完全相同（验证页、错误页）也要各自上传，
+# 因此按 (sha256, name) 区分
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS uploads (
+    sha256 TEXT NOT NULL,
+    name TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    src TEXT NOT NULL,
+    kv_key TEXT,
+    uploaded_at INTEGER NOT NULL,
+    kv_written_at INTEGER,
+    PRIMARY KEY (sha256, name)
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_src ON uploads (src);
+'''
+
+
+def image_sha256(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class UploadLedger:
+    """
+    已上传图片的持久化记录：同一站点内容完全相同的图片直接复用之前的 file_id，
+    已写入 KV 的也不再重复写入，中途失败后重跑只会补传缺失的部分
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 异步上传器的回调和 to_thread 可能在不同线程访问，统一加锁
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, sha256: str, name: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM uploads WHERE sha256 = ? AND name = ?',
+                                     (sha256, name)).fetchone()
+        return dict(row) if row else None
+
+    def record_upload(self, sha256: str, name: str, src: str):
+        """上传到 Telegram 成功后记录，src 为 `<file_id>.<扩展名>`"""
+        file_id = src.rsplit('.', 1)[0]
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO uploads (sha256, name, file_id, src, uploaded_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (sha256, name) DO UPDATE SET file_id = excluded.file_id, src = excluded.src, '
+                'uploaded_at = excluded.uploaded_at, kv_key = NULL, kv_written_at = NULL',
+                (sha256, name, file_id, src, int(time.time())))
+
+    def mark_kv_written(self, kv_key: str):
+        """KV 写入成功后记录，KV 键即上传返回的 src"""
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE uploads SET kv_key = ?, kv_written_at = ? WHERE src = ?',
+                               (kv_key, int(time.time()), kv_key))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -4,34 +4,148 @@
 cron: 2 0 0 * * 6 run_spider_and_upload.py
 new Env('网站爬虫');
 """
+import argparse
 import asyncio
-from website_spider import scrape_main
+from website_browser_profile import BrowserProfile
+from website_crawl_state import DEFAULT_RERENDER_INTERVAL, CrawlStateStore, filter_changed_urls
+from website_spider import scrape_main, scrape_main_sharded
 from pathlib import Path
-from img_upload import ImageUploader
+from img_kv_index import KVKeyIndex
+from img_upload import AsyncImageUploader
+from img_upload_ledger import UploadLedger
+from img_phash import DEFAULT_MAX_DISTANCE, ScreenshotHashIndex, dhash
 
+# 同时上传的协程数量，与 sendMediaGroup 单组上限一致，使 Telegram 调度器能凑满一组
+DEFAULT_UPLOAD_WORKERS = 10
+# 待上传队列长度，队列满时抓取会暂停，避免截图在内存中堆积
+DEFAULT_QUEUE_SIZE = 20
 
-async def run(urls, output_dir='./siteshots'):
+
+async def handle_result(result, uploader, output_path, state_store, hash_index, force=False):
+    """处理一个抓取结果：去重、上传并写入 KV，成功后更新本地状态，force 为 True 时不按渲染内容跳过"""
+    if not result or 'name' not in result:
+        print("结果数据无效，跳过上传")
+        return
+    print("抓取结果:", {key: value for key, value in result.items() if key != 'screenshot'})
+    img_name = result['name']
+    image_hash = await asyncio.to_thread(dhash, result['screenshot']) if result.get('screenshot') else None
+    duplicate = hash_index.find_duplicate(img_name, image_hash) if image_hash is not None else None
+    if duplicate:
+        print(f"{img_name} 截图与上次近似重复（距离 {duplicate['distance']}），跳过上传: {duplicate['src']}")
+        state_store.record(result)
+        return
+    if not force and state_store.is_rendered_unchanged(result):
+        # 静态检查无法判断的站点（SPA、带 nonce 的页面）渲染后才知道内容是否变化
+        print(f"{img_name} 渲染内容与上次相同，跳过上传")
+        state_store.record(result)
+        return
+
+    if uploader.kv_index is not None and uploader.kv_index.has_site(img_name):
+        print(f"{img_name} 在 KV 中已有 {len(uploader.kv_index.keys_for_site(img_name))} 张截图，写入新截图")
+    upload_result = await uploader.upload_and_write_kv(img_name, result.get('screenshot'), str(output_path),
+                                                       result.get('screenshot_format', 'png'))
+    if "src" in upload_result:
+        if upload_result.get('reused'):
+            print(f"内容相同的截图已上传过，复用: {upload_result['src']}")
+        else:
+            print(f"上传成功: {upload_result['src']}")
+        record = {key: result.get(key) for key in ('name', 'url', 'content_hash')}
+
+        def on_stored():
+            state_store.record(record)
+            if image_hash is not None:
+                hash_index.update(img_name, image_hash, upload_result['src'])
+
+        def on_kv_written(future):
+            kv_result = {'error': '已取消'} if future.cancelled() else future.result()
+            if 'error' in kv_result:
+                print(f"写入 KV 失败: {img_name} - {kv_result['error']}")
+                return
+            on_stored()
+
+        if upload_result.get('kv_written'):
+            on_stored()
+        else:
+            # KV 记录攒批写入，不阻塞上传协程；写入成功后再更新本地状态
+            uploader.submit_kv_write(upload_result['src'], img_name).add_done_callback(on_kv_written)
+    else:
+        print(f"上传失败: {upload_result.get('error', '未知错误')} - 完整错误信息: {upload_result}")
+
+
+async def run(urls, output_dir='./siteshots', workers=1, force=False, image_format='jpeg', quality=80,
+              save_screenshots=False, max_distance=DEFAULT_MAX_DISTANCE, upload_workers=DEFAULT_UPLOAD_WORKERS,
+              queue_size=DEFAULT_QUEUE_SIZE, rerender_interval=DEFAULT_RERENDER_INTERVAL):
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
-    scrape_main_results = await scrape_main(urls, str(output_path))
-    print("抓取结果:", scrape_main_results)
-    for result in scrape_main_results:
-        if result and 'name' in result:
-            img_name = result['name']
-            uploader = ImageUploader(str(output_path), img_name)
-            upload_result = uploader.upload_and_write_kv(write_kv=True)
-            if "src" in upload_result:
-                print(f"上传成功: {upload_result['src']}")
-                kv_result = uploader.read_kv_keys()
-                print("KV 存储中的键值对:")
-                if "success" in kv_result:
-                    for key in kv_result['keys']:
-                        print(f"Name: {key['name']}, Metadata: {key['metadata']}")
+    # 启动浏览器前跳过内容未变化的站点，force 为 True 时全部重新抓取
+    state_store = CrawlStateStore()
+    urls, summary = await filter_changed_urls(urls, state_store, force=force, rerender_interval=rerender_interval)
+    if not urls:
+        state_store.save()
+        print(f"所有站点均未变化，跳过 {len(summary['skipped'])} 个站点")
+        return
+    # 与上一次截图近似重复（汉明距离不超过 max_distance）的站点不再上传
+    hash_index = ScreenshotHashIndex(max_distance=max_distance)
+
+    # 抓取和上传同时进行：每个站点截图完成后放入有界队列，由上传协程并发消费
+    upload_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def upload_worker(uploader):
+        while True:
+            result = await upload_queue.get()
+            try:
+                if result is None:
+                    return
+                await handle_result(result, uploader, output_path, state_store, hash_index, force)
+            except Exception as e:
+                print(f"处理上传时发生错误: {e}")
+            finally:
+                upload_queue.task_done()
+
+    async def on_result(index, result):
+        await upload_queue.put(result)
+
+    # 本地 KV 键索引，超过同步间隔时才分页列出远端命名空间，之后由上传器随写入更新
+    kv_index = KVKeyIndex()
+    # 上传记录：中途失败后重跑时，内容相同的截图复用已有的 file_id
+    ledger = UploadLedger()
+    async with AsyncImageUploader(max_concurrency=max(1, upload_workers), kv_index=kv_index,
+                                  ledger=ledger) as uploader:
+        await kv_index.sync(uploader.list_kv_keys)
+        upload_tasks = [asyncio.create_task(upload_worker(uploader)) for _ in range(max(1, upload_workers))]
+        try:
+            # 持久化浏览器缓存，每周重复访问的站点可以直接命中缓存
+            profile = BrowserProfile()
+            # 截图直接保留在内存中上传，save_screenshots 为 True 时同时落盘
+            screenshot_options = {'image_format': image_format, 'quality': quality, 'save_file': save_screenshots,
+                                  # 渲染内容的哈希用于判断站点是否变化
+                                  'with_hash': True}
+            if workers > 1:
+                await scrape_main_sharded(urls, str(output_path), workers=workers, profile=profile,
+                                          on_result=on_result, **screenshot_options)
             else:
-                print(f"上传失败: {upload_result.get('error', '未知错误')} - 完整错误信息: {upload_result}")
-        else:
-            print("结果数据无效，跳过上传")
+                # 有常驻浏览器时直接连接，否则自行启动
+                await scrape_main(urls, str(output_path), use_daemon=True, profile=profile, on_result=on_result,
+                                  **screenshot_options)
+        finally:
+            for _ in upload_tasks:
+                await upload_queue.put(None)
+            await asyncio.gather(*upload_tasks)
+
+    state_store.save()
+    hash_index.save()
+    kv_index.save()
+    ledger.close()
+    print(f"KV 存储中共 {len(kv_index)} 个键")
+    print(f"新站点 {len(summary['new'])} 个, 已变化 {len(summary['changed'])} 个, 到期重新渲染 {len(summary['stale'])} 个, "
+          f"未变化跳过 {len(summary['skipped'])} 个, 未变化强制抓取 {len(summary['forced'])} 个")
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='网站截图抓取并上传')
+    parser.add_argument('--force', action='store_true', help='忽略增量检查，重新抓取所有站点')
+    parser.add_argument('--rerender-days', type=float, default=DEFAULT_RERENDER_INTERVAL / 86400,
+                        help='静态 HTML 未变化的站点最多隔多少天重新渲染一次')
+    args = parser.parse_args()
     urls_to_scrape = ["https://tldv.io/"]
-    asyncio.run(run(urls_to_scrape))
+    asyncio.run(run(urls_to_scrape, force=args.force, rerender_interval=args.rerender_days * 86400))
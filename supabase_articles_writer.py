@@ -1,5 +1,7 @@
 from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
+import asyncio
 import os
 from datetime import datetime
 from logger_base import LoggerBase
@@ -7,16 +9,37 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# 使用 in 过滤时每次查询的值数量，避免请求 URL 过长
+IN_QUERY_CHUNK_SIZE = 200
+# 批量写入时每次请求的文章数量
+DEFAULT_UPSERT_CHUNK_SIZE = 100
+# 同时进行的数据库请求上限，即执行请求的线程数
+DEFAULT_MAX_CONCURRENCY = 8
+
+# PostgreSQL 错误码：ON CONFLICT 指定的列上没有唯一约束
+MISSING_CONFLICT_TARGET_CODE = '42P10'
+
+# insert_articles 返回的每行结果
+OUTCOME_INSERTED = 'inserted'
+OUTCOME_SKIPPED = 'skipped'
+OUTCOME_FAILED = 'failed'
+
 
 class SupabaseArticlesWriter:
-    """用于向 Supabase articles 表写入数据的工具类"""
+    """
+    用于向 Supabase articles 表写入数据的工具类
+
+    Supabase 客户端的 execute() 是阻塞的，所有请求都交给一个有界线程池执行，
+    调用方的事件循环不会被阻塞，多个协程的请求可以同时进行
+    """
 
-    def __init__(self, logger: Optional[LoggerBase] = None):
+    def __init__(self, logger: Optional[LoggerBase] = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
         """
         初始化 SupabaseArticlesWriter
 
         Args:
             logger: 可选的日志记录器实例
+            max_concurrency: 同时进行的数据库请求上限
         """
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_KEY")
@@ -26,6 +49,23 @@ class SupabaseArticlesWriter:
 
         self.client: Client = create_client(self.supabase_url, self.supabase_key)
         self.logger = logger or LoggerBase()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix='supabase')
+        # articles.name 上没有唯一约束时无法 upsert，改为逐篇先查询再插入
+        self._upsert_supported = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """等待进行中的请求完成后关闭线程池"""
+        self._executor.shutdown(wait=True)
+
+    async def _execute(self, query):
+        """在线程池中执行查询，等待期间事件循环可以处理其他协程"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, query.execute)
 
     async def check_article_exists(self, name: str) -> bool:
         """
@@ -38,10 +78,10 @@ class SupabaseArticlesWriter:
             bool: 如果文章存在返回 True，否则返回 False
         """
         try:
-            result = self.client.table('articles')\
+            query = self.client.table('articles')\
                 .select('id')\
-                .eq('name', name)\
-                .execute()
+                .eq('name', name)
+            result = await self._execute(query)
 
             return bool(result.data)
         except Exception as e:
@@ -49,6 +89,31 @@ class SupabaseArticlesWriter:
             self.logger.error(error_msg)
             raise Exception(error_msg)
 
+    async def get_existing_page_nums(self, page_nums: list[int]) -> set[int]:
+        """
+        批量查询已存在的 page_num，用于抓取前过滤已入库的试卷
+
+        Args:
+            page_nums: 待查询的 page_num 列表
+
+        Returns:
+            set[int]: 已存在于 articles 表中的 page_num
+        """
+        try:
+            existing = set()
+            unique_page_nums = list(dict.fromkeys(page_nums))
+            for start in range(0, len(unique_page_nums), IN_QUERY_CHUNK_SIZE):
+                query = self.client.table('articles')\
+                    .select('page_num')\
+                    .in_('page_num', unique_page_nums[start:start + IN_QUERY_CHUNK_SIZE])
+                result = await self._execute(query)
+                existing.update(row['page_num'] for row in result.data)
+            return existing
+        except Exception as e:
+            error_msg = f"批量查询已存在文章时发生错误: {str(e)}"
+            self.logger.error(error_msg)
+            raise Exception(error_msg)
+
     async def insert_article(self, article_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         向 articles 表插入一条文章数据，如果标题不存在的话
@@ -75,7 +140,7 @@ class SupabaseArticlesWriter:
             article_data['created_at'] = datetime.utcnow().isoformat()
 
             # 执行插入操作
-            result = self.client.table('articles').insert(article_data).execute()
+            result = await self._execute(self.client.table('articles').insert(article_data))
 
             if not result.data:
                 raise Exception("插入数据后未返回结果")
@@ -86,6 +151,89 @@ class SupabaseArticlesWriter:
             self.logger.error(error_msg)
             raise Exception(error_msg)
 
+    async def insert_articles(self, articles: list[Dict[str, Any]],
+                              chunk_size: int = DEFAULT_UPSERT_CHUNK_SIZE) -> list[Dict[str, Any]]:
+        """
+        批量写入文章：按 chunk_size 分批 upsert，标题（name）冲突的行由数据库忽略，
+        不再逐篇先查询再插入；依赖 articles.name 上的唯一约束（见 README），
+        数据库返回没有该约束时退回逐篇调用 insert_article
+
+        某一批请求失败时逐行重试该批，只把出错的行记为失败
+
+        Args:
+            articles: 文章数据列表
+            chunk_size: 每次请求写入的文章数量
+
+        Returns:
+            list[Dict[str, Any]]: 与 articles 一一对应的结果
+                {'name': 标题, 'outcome': inserted/skipped/failed, 'data': 插入后的数据, 'error': 错误信息}
+        """
+        results = [{'name': article.get('name'), 'outcome': OUTCOME_SKIPPED, 'data': None, 'error': None}
+                   for article in articles]
+        created_at = datetime.utcnow().isoformat()
+
+        # 同一批里标题重复的只写第一篇，其余直接记为跳过
+        pending = {}
+        for index, article in enumerate(articles):
+            name = article.get('name')
+            if not name:
+                results[index].update(outcome=OUTCOME_FAILED, error="文章数据中缺少标题")
+            elif name not in pending:
+                pending[name] = index
+
+        indexes = list(pending.values())
+        chunk_size = max(1, chunk_size)
+        for start in range(0, len(indexes), chunk_size):
+            chunk = indexes[start:start + chunk_size]
+            rows = [{**articles[index], 'created_at': created_at} for index in chunk]
+            if self._upsert_supported:
+                try:
+                    inserted = await self._upsert_ignoring_duplicates(rows)
+                    for index in chunk:
+                        data = inserted.get(articles[index]['name'])
+                        if data:
+                            results[index].update(outcome=OUTCOME_INSERTED, data=data)
+                    continue
+                except Exception as e:
+                    if getattr(e, 'code', None) == MISSING_CONFLICT_TARGET_CODE:
+                        self._upsert_supported = False
+                        self.logger.error("articles.name 上没有唯一约束，无法批量 upsert，改为逐篇先查询再插入")
+                    else:
+                        self.logger.error(f"批量写入 {len(rows)} 篇文章失败，改为逐篇写入: {str(e)}")
+
+            for index, row in zip(chunk, rows):
+                try:
+                    data = await self._insert_row(row)
+                    if data:
+                        results[index].update(outcome=OUTCOME_INSERTED, data=data)
+                except Exception as row_error:
+                    error_msg = f"插入文章 '{row['name']}' 时发生错误: {str(row_error)}"
+                    self.logger.error(error_msg)
+                    results[index].update(outcome=OUTCOME_FAILED, error=error_msg)
+
+        outcomes = [result['outcome'] for result in results]
+        self.logger.info(f"批量写入 {len(articles)} 篇文章: 新增 {outcomes.count(OUTCOME_INSERTED)} 篇, "
+                         f"已存在跳过 {outcomes.count(OUTCOME_SKIPPED)} 篇, 失败 {outcomes.count(OUTCOME_FAILED)} 篇")
+        return results
+
+    async def _insert_row(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """逐篇写入一行，返回插入后的数据，标题已存在时返回 None"""
+        if self._upsert_supported:
+            try:
+                return (await self._upsert_ignoring_duplicates([row])).get(row['name'])
+            except Exception as e:
+                if getattr(e, 'code', None) != MISSING_CONFLICT_TARGET_CODE:
+                    raise
+                self._upsert_supported = False
+        return await self.insert_article(row)
+
+    async def _upsert_ignoring_duplicates(self, rows: list[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """写入一批文章，已存在的标题不做修改；返回实际插入的行，按标题索引"""
+        query = self.client.table('articles')\
+            .upsert(rows, on_conflict='name', ignore_duplicates=True)
+        result = await self._execute(query)
+        return {row['name']: row for row in result.data or []}
+
     async def get_all_materials_last_questions(self, labelId: Optional[int] = None) -> list[Dict[str, Any]]:
         """
         从 articles 表中查询所有 think 为空的文章材料和最后一个问题，可选根据 label_id 过滤
@@ -104,7 +252,7 @@ class SupabaseArticlesWriter:
             if labelId is not None:
                 query = query.eq('labelId', labelId)
 
-            response = query.execute()
+            response = await self._execute(query)
             result = response.data
 
             if not result:
@@ -145,10 +293,10 @@ class SupabaseArticlesWriter:
                 'answer': answer
             }
 
-            result = self.client.table('articles')\
+            query = self.client.table('articles')\
                 .update(update_data)\
-                .eq('id', article_id)\
-                .execute()
+                .eq('id', article_id)
+            result = await self._execute(query)
 
             if not result.data:
                 raise Exception(f"未找到ID为 {article_id} 的文章或更新失败")
@@ -177,7 +325,7 @@ class SupabaseArticlesWriter:
             if not isinstance(page_num, int) or page_num < 0:
                 raise ValueError("page_num 必须是非负整数")
 
-            response = self.client.table('articles')\
+            query = self.client.table('articles')\
                 .select('''
                     page_num,
                     materials,
@@ -185,8 +333,8 @@ class SupabaseArticlesWriter:
                     answer,
                     think
                 ''')\
-                .eq('page_num', page_num)\
-                .execute()
+                .eq('page_num', page_num)
+            response = await self._execute(query)
 
             if not response.data or len(response.data) == 0:
                 self.logger.info(f"未找到 page_num 为 {page_num} 的文章")
@@ -229,10 +377,10 @@ class SupabaseArticlesWriter:
                 'deep_answers': deep_answers
             }
 
-            result = self.client.table('articles')\
+            query = self.client.table('articles')\
                 .update(update_data)\
-                .eq('page_num', page_num)\
-                .execute()
+                .eq('page_num', page_num)
+            result = await self._execute(query)
 
             if not result.data:
                 raise Exception(f"未找到 page_num 为 {page_num} 的文章或更新失败")
@@ -0,0 +1,245 @@
+"""
+常驻浏览器服务：启动一个长期运行的 Chromium，并把 DevTools websocket 地址写入状态文件，
+scrape_main 通过该地址直接连接，省去每次定时任务的浏览器冷启动
+
+用法: python website_browser_daemon.py [--max-pages 500] [--interval 30] [--max-cache-mb 512]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+import uuid
+from pathlib import Path
+
+from pyppeteer import connect
+
+from website_browser_profile import DEFAULT_MAX_CACHE_BYTES, DEFAULT_PROFILE_DIR, BrowserProfile
+
+# 设置日志记录
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(filename)s - %(funcName)s - %(lineno)d - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 状态文件，记录当前浏览器的 websocket 地址
+DEFAULT_STATE_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.browser_daemon.json'
+# 浏览器累计打开多少个标签页后重启，防止内存持续增长
+DEFAULT_MAX_PAGES = 500
+# 健康检查间隔（秒）
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+# 连接和健康检查的超时（秒）
+CONNECT_TIMEOUT = 10
+# 常驻浏览器的配置目录，与自行启动的浏览器分开，避免两个 Chromium 同时占用一个 userDataDir
+DEFAULT_DAEMON_PROFILE_DIR = DEFAULT_PROFILE_DIR / 'daemon'
+
+
+def read_state(state_file=DEFAULT_STATE_FILE):
+    """读取状态文件，不存在或内容损坏时返回 None"""
+    try:
+        return json.loads(Path(state_file).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(state_file, state):
+    # 先写临时文件再替换，避免客户端读到写了一半的内容
+    state_file = Path(state_file)
+    tmp_file = state_file.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp_file, state_file)
+
+
+def lease_dir(state_file=DEFAULT_STATE_FILE):
+    """客户端租约目录：每个已连接的客户端一个文件，服务只在没有租约时回收浏览器"""
+    return Path(state_file).with_suffix('.leases')
+
+
+def _acquire_lease(state_file):
+    leases = lease_dir(state_file)
+    leases.mkdir(parents=True, exist_ok=True)
+    lease = leases / f'{os.getpid()}-{uuid.uuid4().hex}.lease'
+    lease.write_text(str(os.getpid()), encoding='utf-8')
+    return lease
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def active_leases(state_file=DEFAULT_STATE_FILE):
+    """返回仍然有效的租约数，顺带清理进程已退出的客户端留下的租约"""
+    count = 0
+    for lease in lease_dir(state_file).glob('*.lease'):
+        try:
+            pid = int(lease.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        if _pid_alive(pid):
+            count += 1
+        else:
+            lease.unlink(missing_ok=True)
+    return count
+
+
+async def connect_daemon_browser(state_file=DEFAULT_STATE_FILE):
+    """
+    连接常驻浏览器，连接期间持有一个租约，断开连接时自动释放
+
+    Returns:
+        Browser: 连接成功返回浏览器实例，用完后应调用 disconnect() 而不是 close()；
+        服务未启动或连接失败时返回 None
+    """
+    # 先登记租约再读取地址：服务回收前会先删除状态文件再检查租约，两者不会错过彼此
+    lease = _acquire_lease(state_file)
+    state = read_state(state_file)
+    if not state or not state.get('ws_endpoint'):
+        lease.unlink(missing_ok=True)
+        return None
+    try:
+        browser = await asyncio.wait_for(
+            connect(browserWSEndpoint=state['ws_endpoint'], ignoreHTTPSErrors=True), CONNECT_TIMEOUT)
+    except Exception as e:
+        lease.unlink(missing_ok=True)
+        logger.warning(f"连接常驻浏览器失败，将自行启动浏览器: {str(e) or type(e).__name__}")
+        return None
+    browser.on('disconnected', lambda: lease.unlink(missing_ok=True))
+    logger.info(f"已连接常驻浏览器: {state['ws_endpoint']}")
+    return browser
+
+
+class BrowserDaemon:
+    """
+    管理常驻浏览器的生命周期：启动、健康检查、崩溃重启、按页面数回收
+
+    传入 BrowserProfile 时使用持久化的 userDataDir 和磁盘缓存，每次（重新）启动前按上限淘汰缓存，
+    回收浏览器后缓存仍然保留
+    """
+
+    def __init__(self, state_file=DEFAULT_STATE_FILE, max_pages=DEFAULT_MAX_PAGES,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, profile=None):
+        self.state_file = Path(state_file)
+        self.profile = profile
+        self.max_pages = max_pages
+        self.health_check_interval = health_check_interval
+        self.browser = None
+        self.served_pages = 0
+        self._stopping = asyncio.Event()
+
+    async def _launch(self):
+        # 延迟导入，website_spider 也会导入本模块
+        from website_spider import launch_browser
+
+        self.browser = await launch_browser(self.profile, autoClose=False)
+        self.served_pages = 0
+        self.browser.on('targetcreated', self._on_target_created)
+        self._publish()
+        logger.info(f"常驻浏览器已启动: {self.browser.wsEndpoint}")
+
+    def _publish(self):
+        _write_state(self.state_file, {
+            'ws_endpoint': self.browser.wsEndpoint,
+            'pid': self.browser.process.pid if self.browser.process else None,
+            'launched_at': int(time.time()),
+        })
+
+    def _on_target_created(self, target):
+        if target.type == 'page':
+            self.served_pages += 1
+
+    async def _close(self):
+        browser, self.browser = self.browser, None
+        if not browser:
+            return
+        try:
+            await asyncio.wait_for(browser.close(), CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"关闭浏览器异常: {str(e)}")
+            if browser.process and browser.process.poll() is None:
+                browser.process.kill()
+
+    async def _is_healthy(self):
+        if not self.browser:
+            return False
+        if self.browser.process and self.browser.process.poll() is not None:
+            return False
+        try:
+            await asyncio.wait_for(self.browser.version(), CONNECT_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    def _withdraw_if_idle(self):
+        """
+        没有客户端租约时删除状态文件，之后新的客户端不会再连接当前浏览器；
+        仍有租约时恢复状态文件并返回 False
+        """
+        self.state_file.unlink(missing_ok=True)
+        leases = active_leases(self.state_file)
+        if leases:
+            self._publish()
+            logger.info(f"已累计打开 {self.served_pages} 个标签页，仍有 {leases} 个客户端在使用，暂不回收")
+            return False
+        return True
+
+    async def _check(self):
+        if not await self._is_healthy():
+            logger.warning("常驻浏览器健康检查失败，正在重启")
+            await self._close()
+            await self._launch()
+        elif self.served_pages >= self.max_pages and self._withdraw_if_idle():
+            logger.info(f"已累计打开 {self.served_pages} 个标签页，回收浏览器")
+            await self._close()
+            await self._launch()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def serve(self):
+        """启动浏览器并持续巡检，直到收到退出信号"""
+        await self._launch()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.health_check_interval)
+                except asyncio.TimeoutError:
+                    pass
+                if not self._stopping.is_set():
+                    try:
+                        await self._check()
+                    except Exception as e:
+                        logger.error(f"巡检常驻浏览器异常: {str(e)}", exc_info=True)
+        finally:
+            await self._close()
+            self.state_file.unlink(missing_ok=True)
+            logger.info("常驻浏览器已退出")
+
+
+async def main(args):
+    profile = None if args.no_profile else BrowserProfile(args.profile_dir, args.max_cache_mb * 1024 * 1024)
+    daemon = BrowserDaemon(args.state_file, args.max_pages, args.interval, profile=profile)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, daemon.stop)
+    await daemon.serve()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='常驻浏览器服务')
+    parser.add_argument('--state-file', default=str(DEFAULT_STATE_FILE), help='记录 websocket 地址的状态文件')
+    parser.add_argument('--max-pages', type=int, default=DEFAULT_MAX_PAGES, help='累计打开多少个标签页后回收浏览器')
+    parser.add_argument('--interval', type=int, default=DEFAULT_HEALTH_CHECK_INTERVAL, help='健康检查间隔（秒）')
+    parser.add_argument('--profile-dir', default=str(DEFAULT_DAEMON_PROFILE_DIR), help='持久化的浏览器配置和缓存目录')
+    parser.add_argument('--max-cache-mb', type=int, default=DEFAULT_MAX_CACHE_BYTES // 1024 // 1024,
+                        help='磁盘缓存上限（MB）')
+    parser.add_argument('--no-profile', action='store_true', help='不使用持久化配置，每次启动都是全新的浏览器')
+    asyncio.run(main(parser.parse_args()))
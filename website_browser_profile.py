@@ -0,0 +1,101 @@
+import logging
+import os
+import weakref
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 浏览器配置目录，保存 userDataDir 和磁盘缓存
+DEFAULT_PROFILE_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / '.browser_profile'
+# 磁盘缓存上限（字节）
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+# 淘汰时清理到上限的比例，留出余量避免每次启动都要淘汰
+EVICT_TARGET_RATIO = 0.8
+# Chromium 缓存索引文件，删除后整个缓存需要重建，淘汰时跳过
+_CACHE_INDEX_NAMES = {'index', 'the-real-index'}
+
+
+class BrowserProfile:
+    """管理持久化的浏览器 userDataDir 和磁盘缓存，缓存超过上限时按最近访问时间淘汰"""
+
+    def __init__(self, root=DEFAULT_PROFILE_DIR, max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self.root = Path(root)
+        self.max_cache_bytes = max_cache_bytes
+        self.user_data_dir = self.root / 'user-data'
+        self.cache_dir = self.root / 'cache'
+
+    def for_shard(self, index, shard_count):
+        """多进程模式下每个浏览器需要独立的目录，缓存上限按进程数平分"""
+        return BrowserProfile(self.root / f'shard-{index}', self.max_cache_bytes // max(1, shard_count))
+
+    def chrome_args(self):
+        return [f'--disk-cache-dir={self.cache_dir}', f'--disk-cache-size={self.max_cache_bytes}']
+
+    def prepare(self):
+        """启动浏览器前调用：创建目录并淘汰超出上限的缓存"""
+        self.user_data_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.evict()
+
+    def cache_size(self):
+        return sum(path.stat().st_size for path in self.cache_dir.rglob('*') if path.is_file())
+
+    def evict(self):
+        """
+        按最近访问时间（LRU）删除缓存文件，直到总大小低于上限的 EVICT_TARGET_RATIO
+
+        Returns:
+            int: 释放的字节数
+        """
+        entries = []
+        total = 0
+        for path in self.cache_dir.rglob('*'):
+            if not path.is_file():
+                continue
+            stat = path.stat()
+            total += stat.st_size
+            if path.name not in _CACHE_INDEX_NAMES:
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+
+        if total <= self.max_cache_bytes:
+            return 0
+
+        target = int(self.max_cache_bytes * EVICT_TARGET_RATIO)
+        freed = 0
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total - freed <= target:
+                break
+            try:
+                path.unlink()
+                freed += size
+            except OSError as e:
+                logger.warning(f"删除缓存文件 {path} 失败: {str(e)}")
+        logger.info(f"浏览器缓存 {total / 1024 / 1024:.1f} MB 超过上限，已淘汰 {freed / 1024 / 1024:.1f} MB")
+        return freed
+
+
+class CacheHitCounter:
+    """统计每个标签页的响应数和命中 HTTP 缓存的响应数"""
+
+    def __init__(self):
+        self._counts = weakref.WeakKeyDictionary()
+
+    def attach(self, page):
+        """为标签页注册响应监听，重复调用不会重复注册"""
+        if page in self._counts:
+            return
+        self._counts[page] = [0, 0]
+
+        def on_response(response):
+            counts = self._counts.get(page)
+            if counts is not None:
+                counts[0] += 1
+                if response.fromCache:
+                    counts[1] += 1
+
+        page.on('response', on_response)
+
+    def snapshot(self, page):
+        """返回 (响应数, 命中缓存数)"""
+        total, hits = self._counts.get(page, (0, 0))
+        return total, hits
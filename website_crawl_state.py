@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+import aiohttp
+
+from common_util import CommonUtil
+from website_metadata import DEFAULT_HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# 抓取状态文件，按站点名称记录 ETag/Last-Modified 和内容哈希
+DEFAULT_CRAWL_STATE_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / '.crawl_state.json'
+# 变更检查时同时进行的 HTTP 请求数
+DEFAULT_CHECK_CONCURRENCY = 20
+# 计算静态 HTML 哈希时最多读取的字节数
+MAX_HASH_BYTES = 5 * 1024 * 1024
+# 静态 HTML 未变化的站点最多隔多久（秒）重新渲染一次，SPA 的静态外壳不变但渲染内容可能已变化
+DEFAULT_RERENDER_INTERVAL = 28 * 24 * 3600
+# 计算渲染内容哈希时整段去掉的标签，其中常有每次请求都不同的 nonce、时间戳等
+_VOLATILE_BLOCK_RE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]*>')
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+
+STATUS_NEW = 'new'
+STATUS_CHANGED = 'changed'
+STATUS_UNCHANGED = 'unchanged'
+# 静态 HTML 未变化，但距上次渲染已超过 rerender_interval
+STATUS_STALE = 'stale'
+
+
+def content_hash(content):
+    """计算文本或字节内容的 sha256"""
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='replace')
+    return hashlib.sha256(content).hexdigest()
+
+
+def rendered_content_hash(html):
+    """
+    渲染后页面可见文本的哈希：用正则去掉注释、脚本、样式和所有标签并合并空白，不做完整的 HTML 解析，
+    标签属性中的 nonce、内联脚本中的时间戳不会影响结果
+    """
+    text = _COMMENT_RE.sub(' ', html)
+    text = _VOLATILE_BLOCK_RE.sub(' ', text)
+    text = _TAG_RE.sub(' ', text)
+    return content_hash(' '.join(text.split()))
+
+
+class CrawlStateStore:
+    """本地抓取状态，键为 CommonUtil.get_name_by_url 生成的站点名称"""
+
+    def __init__(self, path=DEFAULT_CRAWL_STATE_FILE):
+        self.path = Path(path)
+        self.sites = {}
+        # 本次检查拿到、但站点还未成功处理的 HTTP 信息
+        self._pending = {}
+        if self.path.exists():
+            try:
+                self.sites = json.loads(self.path.read_text(encoding='utf-8'))
+            except ValueError:
+                logger.warning(f"抓取状态文件 {self.path} 损坏，将重新记录")
+
+    def get(self, name):
+        return self.sites.get(name)
+
+    def set_pending(self, name, http_info):
+        self._pending[name] = http_info
+
+    def mark_unchanged(self, name, http_info):
+        """站点未变化被跳过时更新校验信息和检查时间"""
+        entry = self.sites.setdefault(name, {})
+        entry.update(http_info)
+        entry['checked_at'] = int(time.time())
+
+    def is_rendered_unchanged(self, result):
+        """渲染后的内容与上次成功处理时相同，截图无需重新上传"""
+        entry = self.sites.get(result.get('name')) or {}
+        return bool(result.get('content_hash')) and entry.get('rendered_hash') == result['content_hash']
+
+    def record(self, result):
+        """站点成功处理后调用，保存 HTTP 校验信息和渲染内容的哈希"""
+        name = result['name']
+        entry = dict(self.sites.get(name, {}))
+        entry.update(self._pending.pop(name, {}))
+        entry['url'] = result['url']
+        if result.get('content_hash'):
+            entry['rendered_hash'] = result['content_hash']
+        entry['crawled_at'] = int(time.time())
+        self.sites[name] = entry
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.sites, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+
+async def _read_hash(response):
+    digest = hashlib.sha256()
+    read_bytes = 0
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        digest.update(chunk)
+        read_bytes += len(chunk)
+        if read_bytes >= MAX_HASH_BYTES:
+            break
+    return digest.hexdigest()
+
+
+def _is_stale(entry, rerender_interval):
+    # 从未成功渲染过，或距上次渲染已超过 rerender_interval
+    if not entry.get('rendered_hash'):
+        return True
+    return time.time() - entry.get('crawled_at', 0) >= rerender_interval
+
+
+async def check_site(session, url, entry, timeout=DEFAULT_HTTP_TIMEOUT, rerender_interval=DEFAULT_RERENDER_INTERVAL):
+    """
+    请求站点静态 HTML 判断内容是否变化，已记录的站点带上 If-None-Match/If-Modified-Since
+
+    静态检查只是预过滤：静态 HTML 未变化但距上次渲染超过 rerender_interval 时返回 stale，
+    仍然交给浏览器渲染，是否真正变化由渲染内容的哈希（rendered_hash）决定
+
+    Returns:
+        tuple[str, dict]: (状态, 新的 HTTP 校验信息)
+    """
+    # 无法判断时按新站点/已变化处理，交给浏览器
+    fallback_status = STATUS_CHANGED if entry else STATUS_NEW
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    try:
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status == 304 and entry:
+                return (STATUS_STALE if _is_stale(entry, rerender_interval) else STATUS_UNCHANGED), {}
+            if response.status >= 300:
+                return fallback_status, {}
+            http_info = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'html_hash': await _read_hash(response),
+            }
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.info(f"检查 {url} 是否变化失败: {str(e) or type(e).__name__}")
+        return fallback_status, {}
+
+    if entry and entry.get('html_hash') == http_info['html_hash']:
+        return (STATUS_STALE if _is_stale(entry, rerender_interval) else STATUS_UNCHANGED), http_info
+    return fallback_status, http_info
+
+
+async def filter_changed_urls(urls, store, force=False, concurrency=DEFAULT_CHECK_CONCURRENCY,
+                              timeout=DEFAULT_HTTP_TIMEOUT, rerender_interval=DEFAULT_RERENDER_INTERVAL):
+    """
+    在启动浏览器前过滤掉内容未变化的站点
+
+    Args:
+        urls: 待抓取的站点列表
+        store: CrawlStateStore
+        force: 为 True 时仍然检查并记录，但不跳过任何站点
+        rerender_interval: 静态 HTML 未变化的站点最多隔多久（秒）重新渲染一次
+
+    Returns:
+        tuple[list, dict]: (需要抓取的 urls,
+        汇总 {'new': [...], 'changed': [...], 'stale': [...], 'skipped': [...], 'forced': [...]})，
+        stale 为静态 HTML 未变化但需要重新渲染的站点，forced 为未变化但因 force 仍然抓取的站点
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def check(url):
+            normalized = CommonUtil.normalize_url(url)
+            name = CommonUtil.get_name_by_url(normalized)
+            async with semaphore:
+                status, http_info = await check_site(session, normalized, store.get(name), timeout, rerender_interval)
+            if status == STATUS_UNCHANGED and not force:
+                store.mark_unchanged(name, http_info)
+            else:
+                store.set_pending(name, http_info)
+            return status
+
+        statuses = await asyncio.gather(*(check(url) for url in urls))
+
+    summary = {'new': [], 'changed': [], 'stale': [], 'skipped': [], 'forced': []}
+    urls_to_crawl = []
+    for url, status in zip(urls, statuses):
+        if status == STATUS_UNCHANGED:
+            summary['forced' if force else 'skipped'].append(url)
+        else:
+            summary[status].append(url)
+        if status != STATUS_UNCHANGED or force:
+            urls_to_crawl.append(url)
+
+    logger.info(f"增量检查完成: 新站点 {len(summary['new'])} 个, 已变化 {len(summary['changed'])} 个, "
+                f"到期重新渲染 {len(summary['stale'])} 个, 未变化跳过 {len(summary['skipped'])} 个, 未变化强制抓取 {len(summary['forced'])} 个")
+    return urls_to_crawl, summary
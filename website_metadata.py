@@ -0,0 +1,199 @@
+import asyncio
+import codecs
+import logging
+import re
+from html.parser import HTMLParser
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from common_util import CommonUtil
+
+logger = logging.getLogger(__name__)
+
+# 静态 HTML 请求的默认超时（秒）
+DEFAULT_HTTP_TIMEOUT = 15
+# 增量解析时每次喂给解析器的字节/字符数
+DEFAULT_CHUNK_SIZE = 4 * 1024
+# 流式读取时最多读取的字节数，超过后即使没有遇到 </head> 也停止
+DEFAULT_MAX_HEAD_BYTES = 512 * 1024
+# 可以提取的元数据字段
+METADATA_FIELDS = ('title', 'description', 'og:description')
+
+# svg/math 中的 title 不是页面标题
+_FOREIGN_TAGS = {'svg', 'math'}
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?\s*([A-Za-z0-9_\-]+)', re.IGNORECASE)
+
+
+class HeadMetadataParser(HTMLParser):
+    """
+    增量解析 HTML 头部的元数据，遇到 </head>、<body> 或所需字段全部拿到后 done 置为 True，
+    调用方看到 done 后即可停止喂数据
+    """
+
+    def __init__(self, fields=METADATA_FIELDS):
+        super().__init__(convert_charrefs=True)
+        self.fields = set(fields)
+        self.values = {}
+        self.done = False
+        self._in_title = False
+        self._title_parts = []
+        self._foreign_depth = 0
+
+    def _check_complete(self):
+        # 拿到 description 后就不再需要 og:description
+        pending = self.fields - set(self.values)
+        if 'description' in self.values:
+            pending.discard('og:description')
+        if not pending:
+            self.done = True
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        # head 中出现 svg、自定义元素等其他标签时继续解析，只在 <body>、</head> 处停止，其余由读取上限兜底
+        if tag == 'body':
+            self.done = True
+            return
+        if tag in _FOREIGN_TAGS:
+            self._foreign_depth += 1
+            return
+        if self._foreign_depth:
+            return
+        if tag == 'title' and 'title' in self.fields and 'title' not in self.values:
+            self._in_title = True
+        elif tag == 'meta':
+            attributes = {key.lower(): (value or '') for key, value in attrs}
+            content = attributes.get('content', '').strip()
+            if not content:
+                return
+            if attributes.get('name', '').lower() == 'description':
+                self.values.setdefault('description', content)
+            elif attributes.get('property', '').lower() == 'og:description':
+                self.values.setdefault('og:description', content)
+            self._check_complete()
+
+    def handle_startendtag(self, tag, attrs):
+        # 自闭合的 <svg/> 没有对应的结束标签
+        if tag not in _FOREIGN_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag in _FOREIGN_TAGS and self._foreign_depth:
+            self._foreign_depth -= 1
+        elif self._foreign_depth:
+            return
+        elif tag == 'title' and self._in_title:
+            self._in_title = False
+            self.values['title'] = ''.join(self._title_parts).strip()
+            self._check_complete()
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+
+    def metadata(self):
+        """返回 title 和 description，description 缺失时使用 og:description"""
+        if self._in_title and 'title' not in self.values:
+            self.values['title'] = ''.join(self._title_parts).strip()
+        return {
+            'title': self.values.get('title', ''),
+            'description': self.values.get('description') or self.values.get('og:description', ''),
+        }
+
+
+def extract_metadata(html, chunk_size=DEFAULT_CHUNK_SIZE, max_chars=DEFAULT_MAX_HEAD_BYTES):
+    """
+    只解析 HTML 头部提取标题和描述，描述优先取 meta[name=description]，其次 og:description，
+    没有 </head>、<body> 的页面最多解析 max_chars 个字符
+
+    Returns:
+        dict: 包含 title 和 description
+    """
+    parser = HeadMetadataParser()
+    for start in range(0, min(len(html), max_chars), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        if parser.done:
+            break
+    return parser.metadata()
+
+
+def extract_text(html):
+    """提取页面全文，开销较大，仅在需要时调用"""
+    return BeautifulSoup(html, 'html.parser').get_text()
+
+
+def _sniff_charset(response, head_bytes):
+    if response.charset:
+        return response.charset
+    match = _META_CHARSET_RE.search(head_bytes)
+    if match:
+        return match.group(1).decode('ascii')
+    return 'utf-8'
+
+
+async def read_head_metadata(response, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=DEFAULT_MAX_HEAD_BYTES):
+    """
+    流式读取 aiohttp 响应体，解析完头部元数据后立即停止读取
+
+    Returns:
+        dict: 包含 title 和 description
+    """
+    parser = HeadMetadataParser()
+    decoder = None
+    read_bytes = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        if decoder is None:
+            charset = _sniff_charset(response, chunk)
+            try:
+                decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+            except LookupError:
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        parser.feed(decoder.decode(chunk))
+        read_bytes += len(chunk)
+        if parser.done or read_bytes >= max_bytes:
+            break
+    return parser.metadata()
+
+
+def has_usable_metadata(metadata):
+    """静态 HTML 中同时有标题和描述才认为可用，否则多半是需要 JS 渲染的单页应用"""
+    return bool(metadata and metadata.get('title') and metadata.get('description'))
+
+
+async def fetch_metadata(session, url, timeout=DEFAULT_HTTP_TIMEOUT):
+    """
+    通过普通 HTTP GET 获取页面并提取元数据，不经过浏览器，读到 </head> 即停止
+
+    Args:
+        session: aiohttp.ClientSession
+        url: 站点地址
+        timeout: 请求超时（秒）
+
+    Returns:
+        dict: 与 scrape_website 相同结构的结果，请求失败或不是 HTML 时返回 None
+    """
+    url = CommonUtil.normalize_url(url)
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout), allow_redirects=True) as response:
+            if response.status >= 400:
+                logger.info(f"{url} 返回状态码 {response.status}")
+                return None
+            if 'html' not in response.headers.get('Content-Type', 'text/html'):
+                return None
+            metadata = await read_head_metadata(response)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.info(f"HTTP 获取 {url} 失败: {str(e) or type(e).__name__}")
+        return None
+
+    return {
+        'name': CommonUtil.get_name_by_url(url),
+        'url': url,
+        'title': metadata['title'],
+        'description': metadata['description'],
+        'source': 'http',
+    }
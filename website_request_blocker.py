@@ -0,0 +1,143 @@
+import asyncio
+import fnmatch
+import logging
+import weakref
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 默认拦截的资源类型，不影响截图和标题/描述提取
+# font 会改变页面渲染效果（图标字体等），需要时再手动加入
+DEFAULT_BLOCKED_RESOURCE_TYPES = (
+    'media',
+    'texttrack',
+    'eventsource',
+    'websocket',
+    'manifest',
+)
+
+# 默认拦截的广告、统计、埋点域名，匹配域名本身及其子域名，支持 * 通配
+DEFAULT_BLOCKED_HOSTS = (
+    # Google
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googletagservices.com',
+    'googlesyndication.com',
+    'googleadservices.com',
+    'doubleclick.net',
+    'adservice.google.com',
+    # 社交平台像素
+    'connect.facebook.net',
+    'facebook.com/tr',
+    'ads-twitter.com',
+    'analytics.twitter.com',
+    'analytics.tiktok.com',
+    'snap.licdn.com',
+    'px.ads.linkedin.com',
+    'bat.bing.com',
+    'clarity.ms',
+    # 用户行为分析
+    'hotjar.com',
+    'fullstory.com',
+    'mixpanel.com',
+    'amplitude.com',
+    'segment.io',
+    'cdn.segment.com',
+    'heapanalytics.com',
+    'mouseflow.com',
+    'luckyorange.com',
+    'nr-data.net',
+    'js-agent.newrelic.com',
+    'scorecardresearch.com',
+    'quantserve.com',
+    'mc.yandex.ru',
+    # 国内统计
+    'hm.baidu.com',
+    'cnzz.com',
+    'umeng.com',
+    'growingio.com',
+    'sensorsdata.cn',
+    # 广告网络
+    'taboola.com',
+    'outbrain.com',
+    'criteo.com',
+    'criteo.net',
+    'adsrvr.org',
+    'adnxs.com',
+    'amazon-adsystem.com',
+    'pubmatic.com',
+    'rubiconproject.com',
+    'moatads.com',
+)
+
+
+class RequestBlocker:
+    """按资源类型和域名拦截页面请求，并统计每个标签页被拦截的请求数"""
+
+    def __init__(self, resource_types=DEFAULT_BLOCKED_RESOURCE_TYPES, host_patterns=DEFAULT_BLOCKED_HOSTS):
+        """
+        Args:
+            resource_types: 需要拦截的资源类型，取值见 pyppeteer Request.resourceType
+            host_patterns: 需要拦截的域名，可带路径前缀（如 facebook.com/tr）或 * 通配
+        """
+        self.resource_types = frozenset(resource_types or ())
+        self.host_patterns = tuple(pattern.lower() for pattern in (host_patterns or ()))
+        self._counts = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        # 统计数据与具体标签页绑定，多进程传递时只保留配置
+        state = self.__dict__.copy()
+        del state['_counts']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._counts = weakref.WeakKeyDictionary()
+
+    def _match_host(self, url):
+        parsed = urlparse(url)
+        host = (parsed.hostname or '').lower()
+        path = parsed.path.lower()
+        for pattern in self.host_patterns:
+            pattern_host, _, pattern_path = pattern.partition('/')
+            if '*' in pattern_host:
+                host_matched = fnmatch.fnmatch(host, pattern_host)
+            else:
+                host_matched = host == pattern_host or host.endswith('.' + pattern_host)
+            if host_matched and (not pattern_path or path.lstrip('/').startswith(pattern_path)):
+                return True
+        return False
+
+    def should_block(self, resource_type, url):
+        """判断请求是否需要拦截"""
+        if resource_type in self.resource_types:
+            return True
+        return self._match_host(url)
+
+    def blocked_count(self, page):
+        """返回该标签页累计拦截的请求数"""
+        return self._counts.get(page, 0)
+
+    async def attach(self, page):
+        """为标签页开启请求拦截，重复调用不会重复注册"""
+        if page in self._counts:
+            return
+        self._counts[page] = 0
+        await page.setRequestInterception(True)
+        # pyppeteer 开启拦截时会禁用缓存，重新打开以便复用磁盘缓存
+        await page.setCacheEnabled(True)
+
+        async def handle(request):
+            try:
+                # 主文档导航始终放行，否则页面本身无法打开
+                is_main_navigation = request.isNavigationRequest() and request.frame == page.mainFrame
+                if not is_main_navigation and self.should_block(request.resourceType, request.url):
+                    self._counts[page] = self._counts.get(page, 0) + 1
+                    await request.abort()
+                else:
+                    await request.continue_()
+            except Exception as e:
+                # 页面关闭或请求已被处理时忽略
+                logger.debug(f"处理请求拦截异常: {str(e)}")
+
+        page.on('request', lambda request: asyncio.ensure_future(handle(request)))
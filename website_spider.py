@@ -1,14 +1,23 @@
 import asyncio
+import base64
 import logging
+import multiprocessing
 import os
 import random
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import platform
+from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
+import aiohttp
 from pyppeteer import launch
 from common_util import CommonUtil
+from website_browser_daemon import DEFAULT_STATE_FILE, connect_daemon_browser
+from website_browser_profile import CacheHitCounter
+from website_crawl_state import rendered_content_hash
+from website_metadata import DEFAULT_HTTP_TIMEOUT, extract_metadata, extract_text, fetch_metadata, has_usable_metadata
+from website_request_blocker import DEFAULT_BLOCKED_RESOURCE_TYPES, RequestBlocker
 
 # 设置日志记录
 logging.basicConfig(
@@ -38,16 +47,64 @@ if platform.system() == "Windows":
 else:
     chromium_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chrome-linux", "chrome")
 
+# 同时打开的最大标签页数量
+DEFAULT_MAX_TABS = 5
+# 单个站点的最长处理时间（秒），超时后放弃该站点并重建标签页
+DEFAULT_URL_TIMEOUT = 90
+# 多进程模式下的默认进程数，每个进程运行独立的浏览器
+DEFAULT_SHARD_WORKERS = min(4, os.cpu_count() or 1)
+# 仅元数据模式下同时进行的 HTTP 请求数
+DEFAULT_HTTP_CONCURRENCY = 50
+# 截图格式及对应的文件扩展名
+SCREENSHOT_FORMATS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+# jpeg/webp 截图的默认质量
+DEFAULT_SCREENSHOT_QUALITY = 80
 
-async def scrape_website(url, browser, output_dir='./screenshots'):
+
+async def capture_screenshot(page, clip, image_format='png', quality=DEFAULT_SCREENSHOT_QUALITY):
+    """
+    截取页面指定区域并直接返回图片字节，image_format 可选 png、jpeg、webp
+    """
+    if image_format not in SCREENSHOT_FORMATS:
+        raise ValueError(f"不支持的截图格式: {image_format}")
+    if image_format in ('jpeg', 'webp'):
+        # pyppeteer 的 screenshot 不支持 webp，且不会把 jpeg 的 quality 传给浏览器，这两种格式直接调用 DevTools 协议
+        result = await page._client.send('Page.captureScreenshot', {
+            'format': image_format,
+            'quality': quality,
+            'clip': dict(clip, scale=1),
+        })
+        return base64.b64decode(result.get('data', b''))
+    return await page.screenshot({'type': image_format, 'clip': dict(clip)})
+
+
+async def scrape_website(url, browser, output_dir='./screenshots', page=None, blocker=None, take_screenshot=True,
+                         with_text=False, cache_counter=None, image_format='png', quality=DEFAULT_SCREENSHOT_QUALITY,
+                         save_file=True, with_hash=False):
+    """
+    抓取单个站点，传入 page 时复用该标签页且不负责关闭，传入 blocker 时拦截无关请求，
+    take_screenshot 为 False 时只提取标题和描述，with_text 为 True 时结果中附带页面全文 content，
+    with_hash 为 True 时结果中附带渲染内容的哈希 content_hash，传入 cache_counter 时结果中附带缓存命中统计
+
+    截图字节放在结果的 screenshot 中，格式由 image_format（png/jpeg/webp）和 quality 决定，
+    save_file 为 True 时同时保存到 output_dir
+    """
     start_time = int(time.time())
-    page = None
+    owns_page = page is None
     try:
         logger.info("正在处理：" + url)
-        if not url.startswith('http://') and not url.startswith('https://'):
-            url = 'https://' + url
+        url = CommonUtil.normalize_url(url)
 
-        page = await browser.newPage()
+        if owns_page:
+            page = await browser.newPage()
+        blocked_start = 0
+        if blocker:
+            await blocker.attach(page)
+            blocked_start = blocker.blocked_count(page)
+        cache_start = (0, 0)
+        if cache_counter:
+            cache_counter.attach(page)
+            cache_start = cache_counter.snapshot(page)
         await page.setUserAgent(random.choice(global_agent_headers))
         width = 1920
         height = 1080
@@ -55,21 +112,34 @@ async def scrape_website(url, browser, output_dir='./screenshots'):
         await page.goto(url, {'timeout': 60000, 'waitUntil': ['load', 'networkidle2']})
 
         origin_content = await page.content()
-        soup = BeautifulSoup(origin_content, 'html.parser')
-        title = soup.title.string.strip() if soup.title else ''
+        metadata = extract_metadata(origin_content)
+        title = metadata['title']
+        description = metadata['description']
         name = CommonUtil.get_name_by_url(url)
         logger.info(f"生成的站点名称: {name}")
 
-        description = ''
-        meta_description = soup.find('meta', attrs={'name': 'description'})
-        if meta_description:
-            description = meta_description['content'].strip()
+        logger.info(f"url:{url}, title:{title},description:{description}")
 
-        if not description:
-            meta_description = soup.find('meta', attrs={'property': 'og:description'})
-            description = meta_description['content'].strip() if meta_description else ''
+        result = {
+            'name': name,
+            'url': url,
+            'title': title,
+            'description': description,
+            'source': 'browser',
+        }
+        if with_hash:
+            # 正则处理 1 MB 页面约 25 ms，放到线程中执行，不阻塞其他标签页
+            result['content_hash'] = await asyncio.to_thread(rendered_content_hash, origin_content)
+        if with_text:
+            result['content'] = extract_text(origin_content)
+        if cache_counter:
+            cache_end = cache_counter.snapshot(page)
+            result['cache_requests'] = cache_end[0] - cache_start[0]
+            result['cache_hits'] = cache_end[1] - cache_start[1]
 
-        logger.info(f"url:{url}, title:{title},description:{description}")
+        if not take_screenshot:
+            result['blocked_requests'] = blocker.blocked_count(page) - blocked_start if blocker else 0
+            return result
 
         dimensions = await page.evaluate('''() => {
                        return {
@@ -82,58 +152,295 @@ async def scrape_website(url, browser, output_dir='./screenshots'):
         actual_width = min(width, dimensions['width'])
         actual_height = min(height, dimensions['height'])
 
-        # 使用相对路径
-        output_path = Path(output_dir)
-        screenshot_path = output_path / f"{name}.png"
-
-        # 确保输出目录存在
-        output_path.mkdir(parents=True, exist_ok=True)
-
-        await page.screenshot({'path': str(screenshot_path), 'clip': {
+        encode_start = time.perf_counter()
+        screenshot = await capture_screenshot(page, {
             'x': 0,
             'y': 0,
             'width': actual_width,
             'height': actual_height,
-        }})
-        content = soup.get_text()
-        print(content)
-        logger.info(url + "站点处理成功")
-        return {
-            'name': name,
-            'url': url,
-            'title': title,
-            'description': description,
-        }
+        }, image_format, quality)
+        encode_ms = int((time.perf_counter() - encode_start) * 1000)
+        result.update({
+            'screenshot': screenshot,
+            'screenshot_format': image_format,
+            'screenshot_bytes': len(screenshot),
+            'encode_ms': encode_ms,
+        })
+        logger.info(f"{name} 截图格式 {image_format}，大小 {len(screenshot)} 字节，编码耗时 {encode_ms} ms")
+
+        if save_file:
+            # 使用相对路径
+            output_path = Path(output_dir)
+            # 确保输出目录存在
+            output_path.mkdir(parents=True, exist_ok=True)
+            (output_path / f"{name}.{SCREENSHOT_FORMATS[image_format]}").write_bytes(screenshot)
+
+        result['blocked_requests'] = blocker.blocked_count(page) - blocked_start if blocker else 0
+        logger.info(url + f"站点处理成功，拦截请求 {result['blocked_requests']} 个")
+        return result
     except Exception as e:
         logger.error(f"处理 {url} 站点异常，错误信息: {str(e)}", exc_info=True)
         return None
     finally:
-        if page:
+        if owns_page and page:
             await page.close()
         execution_time = int(time.time()) - start_time
         logger.info(f"处理 {url} 用时：{execution_time} 秒")
 
 
-async def scrape_main(urls, output_dir='./screenshots'):
+async def _close_page(page):
+    try:
+        await page.close()
+    except Exception as e:
+        logger.warning(f"关闭标签页异常: {str(e)}")
+
+
+async def scrape_with_page_pool(urls, browser, output_dir='./screenshots',
+                                max_tabs=DEFAULT_MAX_TABS, url_timeout=DEFAULT_URL_TIMEOUT, on_result=None,
+                                **scrape_options):
+    """
+    使用固定数量的标签页轮流处理 urls，结果顺序与 urls 一致，
+    scrape_options 原样传给 scrape_website（blocker、take_screenshot、image_format 等）
+
+    on_result 为 async 回调 on_result(index, result)，每个站点处理完立即调用，
+    标签页会等回调返回后才处理下一个站点，回调中写入有界队列即可形成背压
+    """
+    results = [None] * len(urls)
+    url_queue = asyncio.Queue()
+    for index, url in enumerate(urls):
+        url_queue.put_nowait((index, url))
+
+    async def worker():
+        # 标签页在处理站点时才创建，出错后丢弃并在下一个站点重建；任何异常只影响当前站点，结果保持为 None
+        page = None
+        try:
+            while True:
+                try:
+                    index, url = url_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    if page is None:
+                        page = await browser.newPage()
+                    results[index] = await asyncio.wait_for(
+                        scrape_website(url, browser, output_dir, page=page, **scrape_options),
+                        timeout=url_timeout)
+                    # 导航到空白页，释放上一个站点占用的内存
+                    await page.goto('about:blank')
+                except asyncio.TimeoutError:
+                    logger.error(f"处理 {url} 超过 {url_timeout} 秒，已放弃")
+                    if page is not None:
+                        await _close_page(page)
+                    page = None
+                except Exception as e:
+                    logger.error(f"标签页复用异常: {str(e)}")
+                    if page is not None:
+                        await _close_page(page)
+                    page = None
+                if on_result:
+                    try:
+                        await on_result(index, results[index])
+                    except Exception as e:
+                        logger.error(f"处理 {url} 的结果回调异常: {str(e)}", exc_info=True)
+        finally:
+            if page is not None:
+                await _close_page(page)
+
+    worker_count = min(max(1, max_tabs), len(urls))
+    await asyncio.gather(*(worker() for _ in range(worker_count)))
+    return results
+
+
+async def launch_browser(profile=None, **options):
+    """
+    使用统一的启动参数启动 Chromium，options 会覆盖默认参数，
+    传入 BrowserProfile 时使用持久化的 userDataDir 和磁盘缓存
+    """
+    launch_options = dict(
+        headless=True,
+        ignoreDefaultArgs=["--enable-automation"],
+        ignoreHTTPSErrors=True,
+        args=['--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu',
+              '--disable-software-rasterizer', '--disable-setuid-sandbox'],
+        handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False,
+        executablePath=chromium_path
+    )
+    if profile:
+        profile.prepare()
+        launch_options['userDataDir'] = str(profile.user_data_dir)
+        launch_options['args'] = launch_options['args'] + profile.chrome_args()
+    launch_options.update(options)
+    return await launch(**launch_options)
+
+
+def _log_cache_ratio(results):
+    results = [result for result in results or [] if result and 'cache_requests' in result]
+    requests_count = sum(result['cache_requests'] for result in results)
+    hits = sum(result['cache_hits'] for result in results)
+    if requests_count:
+        logger.info(f"本次运行缓存命中率: {hits}/{requests_count} ({hits / requests_count:.1%})")
+
+
+async def scrape_main(urls, output_dir='./screenshots', max_tabs=DEFAULT_MAX_TABS, url_timeout=DEFAULT_URL_TIMEOUT,
+                      block_requests=True, blocker=None, use_daemon=False,
+                      daemon_state_file=DEFAULT_STATE_FILE, profile=None, **scrape_options):
     """
     主函数，用于管理浏览器实例，批量抓取网站信息
+
+    Args:
+        urls: 待抓取的站点列表
+        output_dir: 截图保存目录
+        max_tabs: 同时打开的最大标签页数量
+        url_timeout: 单个站点的最长处理时间（秒）
+        block_requests: 是否拦截媒体、广告、统计等无关请求
+        blocker: 自定义的 RequestBlocker，为空时使用默认拦截规则
+        use_daemon: 是否优先连接常驻浏览器（见 website_browser_daemon.py），连接失败时自行启动
+        daemon_state_file: 常驻浏览器的状态文件
+        profile: BrowserProfile，自行启动浏览器时使用持久化的 userDataDir 和磁盘缓存
+        scrape_options: 传给 scrape_website 的其他参数，如 with_text、with_hash、image_format、quality、save_file，
+            以及 scrape_with_page_pool 的 on_result 回调
     """
     browser = None
+    attached = False
+    if block_requests and blocker is None:
+        blocker = RequestBlocker()
+    elif not block_requests:
+        blocker = None
     try:
-        browser = await launch(
-            headless=True,
-            ignoreDefaultArgs=["--enable-automation"],
-            ignoreHTTPSErrors=True,
-            args=['--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu',
-                  '--disable-software-rasterizer', '--disable-setuid-sandbox'],
-            handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False,
-            executablePath=chromium_path
-        )
-        tasks = [scrape_website(url, browser, output_dir) for url in urls]
-        results = await asyncio.gather(*tasks)
+        if use_daemon:
+            browser = await connect_daemon_browser(daemon_state_file)
+            attached = browser is not None
+        if not browser:
+            browser = await launch_browser(profile)
+        results = await scrape_with_page_pool(urls, browser, output_dir, max_tabs, url_timeout, blocker=blocker,
+                                              cache_counter=CacheHitCounter(), **scrape_options)
+        _log_cache_ratio(results)
         return results
     except Exception as e:
         logger.error("主程序异常: %s", e, exc_info=True)
+    finally:
+        if attached:
+            # 常驻浏览器由服务进程管理，这里只断开连接
+            await browser.disconnect()
+        elif browser:
+            await browser.close()
+
+
+def shard_urls_by_host(urls, workers):
+    """
+    按域名把 urls 分配到 workers 个分片，同一域名的站点落在同一分片，
+    分片之间按站点数量尽量均衡
+
+    Returns:
+        list[list[tuple[int, str]]]: 每个分片内为 (原始下标, url)
+    """
+    groups = {}
+    for index, url in enumerate(urls):
+        host = urlparse(url if '://' in url else 'https://' + url).netloc.lower()
+        if host.startswith('www.'):
+            host = host[4:]
+        groups.setdefault(host, []).append((index, url))
+
+    shards = [[] for _ in range(max(1, workers))]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(shards, key=len).extend(group)
+    return [shard for shard in shards if shard]
+
+
+def _scrape_shard(shard_urls, output_dir, max_tabs, url_timeout, block_requests, blocker, profile, scrape_options):
+    """子进程入口：运行独立的事件循环和浏览器"""
+    results = asyncio.run(scrape_main(shard_urls, output_dir, max_tabs, url_timeout, block_requests, blocker,
+                                      profile=profile, **scrape_options))
+    return results or [None] * len(shard_urls)
+
+
+async def scrape_main_sharded(urls, output_dir='./screenshots', workers=DEFAULT_SHARD_WORKERS,
+                              max_tabs=DEFAULT_MAX_TABS, url_timeout=DEFAULT_URL_TIMEOUT,
+                              block_requests=True, blocker=None, profile=None, **scrape_options):
+    """
+    多进程抓取，把 urls 按域名拆分到 workers 个进程，每个进程最多打开 max_tabs 个标签页，
+    合并后的结果顺序与 urls 一致，传入 profile 时每个进程使用其下独立的子目录，
+    on_result 回调无法跨进程传递，会在所有分片完成后依次调用
+    """
+    shards = shard_urls_by_host(urls, workers)
+    if len(shards) <= 1:
+        return await scrape_main(urls, output_dir, max_tabs, url_timeout, block_requests, blocker, profile=profile,
+                                 **scrape_options)
+
+    on_result = scrape_options.pop('on_result', None)
+    results = [None] * len(urls)
+    loop = asyncio.get_running_loop()
+    # spawn 避免子进程继承父进程的事件循环和浏览器连接
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            loop.run_in_executor(executor, _scrape_shard, [url for _, url in shard], output_dir, max_tabs,
+                                 url_timeout, block_requests, blocker,
+                                 profile.for_shard(index, len(shards)) if profile else None, scrape_options)
+            for index, shard in enumerate(shards)
+        ]
+        shard_results = await asyncio.gather(*futures, return_exceptions=True)
+
+    for shard, shard_result in zip(shards, shard_results):
+        if isinstance(shard_result, BaseException):
+            logger.error(f"分片进程异常: {shard_result}", exc_info=shard_result)
+            continue
+        for (index, _), result in zip(shard, shard_result):
+            results[index] = result
+    _log_cache_ratio(results)
+    if on_result:
+        for index, result in enumerate(results):
+            await on_result(index, result)
+    return results
+
+
+async def scrape_metadata_main(urls, concurrency=DEFAULT_HTTP_CONCURRENCY, http_timeout=DEFAULT_HTTP_TIMEOUT,
+                               browser_fallback=True, max_tabs=DEFAULT_MAX_TABS, url_timeout=DEFAULT_URL_TIMEOUT):
+    """
+    仅元数据模式：先用 HTTP 获取静态 HTML 提取标题和描述，只有静态 HTML 中没有可用元数据
+    （如需要 JS 渲染的单页应用）时才启动浏览器补抓，不截图
+
+    Args:
+        urls: 待抓取的站点列表
+        concurrency: 同时进行的 HTTP 请求数
+        http_timeout: 单个 HTTP 请求的超时（秒）
+        browser_fallback: 是否对缺少元数据的站点使用浏览器补抓
+        max_tabs: 浏览器补抓时的最大标签页数量
+        url_timeout: 浏览器补抓时单个站点的最长处理时间（秒）
+
+    Returns:
+        list: 与 urls 顺序一致的结果，结果中 source 表示数据来自 http 还是 browser
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=False, ttl_dns_cache=300)
+    headers = {'User-Agent': random.choice(global_agent_headers)}
+
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+        async def fetch(url):
+            async with semaphore:
+                return await fetch_metadata(session, url, http_timeout)
+
+        results = list(await asyncio.gather(*(fetch(url) for url in urls)))
+
+    fallback_indexes = [index for index, result in enumerate(results) if not has_usable_metadata(result)]
+    logger.info(f"HTTP 获取元数据完成，{len(urls) - len(fallback_indexes)}/{len(urls)} 个站点无需浏览器")
+    if not browser_fallback or not fallback_indexes:
+        return results
+
+    browser = None
+    try:
+        browser = await launch_browser()
+        fallback_results = await scrape_with_page_pool(
+            [urls[index] for index in fallback_indexes], browser, max_tabs=max_tabs, url_timeout=url_timeout,
+            # 不截图时图片、字体、样式都不需要加载
+            blocker=RequestBlocker(resource_types=DEFAULT_BLOCKED_RESOURCE_TYPES + ('image', 'font', 'stylesheet')),
+            take_screenshot=False)
+        for index, fallback_result in zip(fallback_indexes, fallback_results):
+            # 浏览器也失败时保留 HTTP 拿到的部分结果
+            if fallback_result:
+                results[index] = fallback_result
+    except Exception as e:
+        logger.error("浏览器补抓异常: %s", e, exc_info=True)
     finally:
         if browser:
             await browser.close()
+    return results